@@ -0,0 +1,159 @@
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+from metrics import stats
+from slog import slog
+
+# One converter report sent from a worker to the aggregator: wrid, power, totalkwh
+REPORT = struct.Struct('>8sdd')
+
+
+class TotalClient:
+
+    # Stands in for Total in a worker process: the power of every decoded
+    # converter is sent to the Aggregator, which calculates the fleet total
+    # over all workers. data() returns None, so the worker publishes no total.
+    # sock does not block: while the aggregator is busy, reports are dropped and
+    # counted rather than stopping the event loop of the worker.
+
+    def __init__(self, sock, l = None):
+        if l == None:
+            self.__log = slog('TotalClient class')
+        else:
+            self.__log = l
+        self.__sock = sock
+
+    def data(self, wrdata):
+        if not wrdata:
+            return None
+        msg = b''.join(REPORT.pack(w['wrid'].encode(), w['power'], w['totalkwh']) for w in wrdata)
+        try:
+            self.__sock.send(msg)
+        except BlockingIOError:
+            stats.reports_dropped += 1
+        except OSError as e:
+            self.__log.logMsg('Sending converter data to aggregator failed: ' + str(e), 2)
+        return None
+
+
+class Aggregator:
+
+    # Runs in the parent process of --workers mode. Forks the workers,
+    # restarts them when they die and publishes the fleet total from the
+    # converter reports of all workers.
+
+    def __init__(self, workers, run_worker, l = None):
+        if l == None:
+            self.__log = slog('Aggregator class')
+        else:
+            self.__log = l
+        self.__workers    = workers
+        self.__run_worker = run_worker
+        self.__pids       = {}
+        self.__sock, self.__worker_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.__sock.settimeout(1)
+        # called by main_loop after SIGHUP, the workers reload on their own
+        self.on_reload    = None
+        self.__reload     = False
+        # set by SIGCHLD, dead workers are restarted by main_loop
+        self.__child      = False
+
+    def spawn(self, worker):
+        pid = os.fork()
+        if pid == 0:
+            # worker process, never returns. A SIGHUP passed on before the worker
+            # has installed its handler must not kill it.
+            status = 1
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                self.__sock.close()
+                self.__worker_sock.setblocking(False)
+                self.__run_worker(worker, TotalClient(self.__worker_sock))
+                status = 0
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else int(e.code != None)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                # never return into the __main__ code of the parent
+                os._exit(status)
+        self.__pids[pid] = worker
+        self.__log.logMsg('Started worker ' + str(worker) + ' with pid ' + str(pid), 2)
+
+    def start(self):
+        for worker in range(self.__workers):
+            self.spawn(worker)
+
+    def reap(self):
+        # Restart workers that have died
+        while self.__pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            worker = self.__pids.pop(pid, None)
+            if worker != None:
+                self.__log.logMsg('Worker ' + str(worker) + ' (pid ' + str(pid) + ') exited with status ' + str(status) + ', restarting', 2)
+                self.spawn(worker)
+
+    def main_loop(self, total, publisher, analytics = None):
+        while True:
+            if self.__reload:
+                self.__reload = False
+                if self.on_reload:
+                    self.on_reload()
+            if self.__child:
+                self.__child = False
+                self.reap()
+            try:
+                msg = self.__sock.recv(65536)
+            except socket.timeout:
+                self.reap()
+                continue
+            wrdata = [{'wrid': wrid.decode(), 'power': power, 'totalkwh': kwh} for wrid, power, kwh in REPORT.iter_unpack(msg)]
+            if analytics != None:
+                analytics.update(wrdata)
+            msg = total.data(wrdata)
+            if msg:
+                publisher.frame([], msg)
+            if analytics != None and analytics.due():
+                publisher.analytics(analytics.data())
+
+    def stop(self):
+        # Terminate all workers
+        pids = list(self.__pids)
+        self.__pids = {}
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+    def sighup_handler(self, signum, frame):
+        self.__log.logMsg('Received SIGHUP, reloading configuration of all workers', 2)
+        for pid in self.__pids:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except OSError:
+                pass
+        self.__reload = True
+
+    def sigchld_handler(self, signum, frame):
+        # Reaping is left to main_loop, spawn() must not run in a signal handler
+        self.__child = True
+
+    def sigterm_handler(self, signal, frame):
+        self.__log.logMsg('Received SIGTERM, stopping workers', 2)
+        self.stop()
+        self.__log.logMsg('Stopping server', 1)
+        self.__log.stop()
+        sys.exit(0)
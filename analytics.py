@@ -0,0 +1,113 @@
+import array
+import math
+import time
+from datetime import datetime
+from slog import slog
+
+
+class Analytics:
+
+    # Derived values per converter, updated in O(1) per reading:
+    #
+    #   energy_today  kWh since local midnight, from the increase of totalkwh
+    #   energy        kWh since the proxy started
+    #   peak_power    highest power today and peak_time, when it was reached
+    #   power_ewma    power smoothed with a time constant of ewma seconds
+    #
+    # A totalkwh lower than the previous one is taken as a counter reset and
+    # the new value as the energy since the reset. The increase between the
+    # last reading before and the first reading after local midnight counts for
+    # the new day; converters produce next to nothing at night, and for a gap
+    # over night most of it is from the morning. The state of all converters
+    # is kept in arrays, one slot per converter.
+
+    COLUMNS = ('kwh', 'energy_today', 'energy', 'peak_power', 'peak_time', 'power_ewma', 'time')
+
+    def __init__(self, l = None, interval = 300.0, ewma = 300.0):
+        if l == None:
+            self.__log = slog('Analytics class')
+        else:
+            self.__log = l
+        # seconds between two publishes
+        self.interval  = interval
+        self.ewma      = ewma
+        self.slots     = {}
+        for name in self.COLUMNS:
+            setattr(self, name, array.array('d'))
+        self.resets    = 0
+        self.__day_end = 0.0
+        self.__next    = 0.0
+
+    def configure(self, config):
+        # Called on reload, analytics can only be switched on or off by a restart
+        c = config['enverproxy']
+        interval = float(c.get('analytics_interval', '0'))
+        if interval > 0:
+            self.interval = interval
+        self.ewma = float(c.get('analytics_ewma', '300'))
+
+    def __new_day(self, now):
+        # Local midnight after now
+        t = time.localtime(now)
+        midnight = time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+        if self.__day_end:
+            self.__log.logMsg('Analytics: new day, resetting daily values', 3)
+            for slot in range(len(self.energy_today)):
+                self.energy_today[slot] = 0.0
+                self.peak_power[slot] = 0.0
+                self.peak_time[slot] = 0.0
+        self.__day_end = midnight
+
+    def update(self, wrdata, now = None):
+        if now == None:
+            now = time.time()
+        if now >= self.__day_end:
+            self.__new_day(now)
+        for wrdict in wrdata:
+            id = wrdict['wrid']
+            kwh = wrdict['totalkwh']
+            power = wrdict['power']
+            slot = self.slots.get(id)
+            if slot == None:
+                slot = self.slots[id] = len(self.kwh)
+                for name, value in zip(self.COLUMNS, (kwh, 0.0, 0.0, power, now, power, now)):
+                    getattr(self, name).append(value)
+                continue
+            delta = kwh - self.kwh[slot]
+            if delta < 0:
+                self.resets += 1
+                self.__log.logMsg(lambda: 'Analytics: totalkwh of ' + id + ' was reset', 3)
+                delta = kwh
+            self.kwh[slot] = kwh
+            self.energy_today[slot] += delta
+            self.energy[slot] += delta
+            if power > self.peak_power[slot]:
+                self.peak_power[slot] = power
+                self.peak_time[slot] = now
+            dt = now - self.time[slot]
+            if dt > 0:
+                alpha = 1.0 - math.exp(-dt / self.ewma) if self.ewma > 0 else 1.0
+                self.power_ewma[slot] += alpha * (power - self.power_ewma[slot])
+            self.time[slot] = now
+
+    def due(self, now = None):
+        # True once per interval
+        if now == None:
+            now = time.time()
+        if now < self.__next:
+            return False
+        self.__next = now + self.interval
+        return True
+
+    def data(self):
+        # Derived values of all converters, converter id -> values
+        result = {}
+        for id, slot in self.slots.items():
+            result[id] = {
+                'energy_today': self.energy_today[slot],
+                'energy': self.energy[slot],
+                'peak_power': self.peak_power[slot],
+                'peak_time': datetime.fromtimestamp(self.peak_time[slot]).isoformat() if self.peak_time[slot] else None,
+                'power_ewma': self.power_ewma[slot],
+            }
+        return result
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# Frames decoded per second by decoder.decode and the former hex string decoder,
+# tests/test_decoder.py checks that both return the same
+#
+#   python3 bench/bench_decoder.py
+
+import argparse
+import time
+
+import benchlib
+import decoder
+
+
+def extract(data, wrind):
+    # hex string decoder used by enverproxy up to version 1.4
+    pos1 = 40 + (wrind*64)
+    d_wr_id         = data[pos1:pos1+8]
+    d_hex_dc        = data[pos1+12:pos1+12+4]
+    d_hex_power     = data[pos1+16:pos1+16+4]
+    d_hex_total     = data[pos1+20:pos1+20+8]
+    d_hex_temp      = data[pos1+28:pos1+28+4]
+    d_hex_ac        = data[pos1+32:pos1+32+4]
+    d_hex_freq      = data[pos1+36:pos1+36+4]
+    d_hex_remaining = data[pos1+40:pos1+40+24]
+    d_dez_dc    = int(d_hex_dc, 16)/512
+    d_dez_power = int(d_hex_power, 16)/64
+    d_dez_total = int(d_hex_total, 16)/8192
+    d_dez_temp  = ((int(d_hex_temp[0:2], 16)*256+int(d_hex_temp[2:4], 16))/ 128)-40
+    d_dez_ac    = int(d_hex_ac, 16)/64
+    d_dez_freq  = int(d_hex_freq[0:2], 16)+int(d_hex_freq[2:4], 16)/ 256
+    if int(d_wr_id, base=16) != 0:
+        return {'wrid' : d_wr_id, 'dc' : d_dez_dc, 'power' : d_dez_power, 'totalkwh' : d_dez_total, 'temp' : d_dez_temp, 'ac' : d_dez_ac, 'freq' : d_dez_freq, 'remaining' : d_hex_remaining}
+
+
+def process_data(data):
+    datainhex = data.hex()
+    wr = []
+    wr_index = 0
+    wr_index_max = ((len(datainhex)-40)//64)
+    while True:
+        response = extract(datainhex, wr_index)
+        if response:
+            wr.append(response)
+        wr_index += 1
+        if wr_index >= wr_index_max:
+            break
+    return wr
+
+
+def bench(name, func, frames, seconds):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for f in frames:
+            func(f)
+        count += len(frames)
+    elapsed = time.perf_counter() - start
+    print('%-8s %9.0f frames/s' % (name, count / elapsed))
+    return count / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('bench_decoder')
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+    for converters in (1, 30):
+        print(str(converters) + ' converter(s) per frame:')
+        frame = [benchlib.payload(range(1, converters + 1))]
+        old = bench('hex', process_data, frame, args.seconds)
+        new = bench('struct', decoder.decode, frame, args.seconds)
+        print('speedup  %9.1fx' % (new / old))
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+# Accept and frame handling throughput of TheServer with many concurrent bridges
+#
+#   python3 bench/bench_eventloop.py --connections 1000 5000 10000
+
+import argparse
+import selectors
+import socket
+import time
+
+import benchlib
+
+
+def wait_for(counter, value, timeout):
+    end = time.monotonic() + timeout
+    while counter.value < value:
+        if time.monotonic() > end:
+            raise TimeoutError('server handled ' + str(counter.value) + ' of ' + str(value) + ' messages')
+        time.sleep(0.001)
+
+
+def run(n, rounds, timeout, forward_to):
+    proc, port, counter = benchlib.start_server(forward_to)
+    sel = selectors.DefaultSelector()
+    socks = []
+    try:
+        # accept + handshake: every bridge connects and waits for the 680030681007 reply
+        start = time.monotonic()
+        sent = {}
+        latency = []
+        for i in range(n):
+            s = socket.create_connection(('127.0.0.1', port))
+            s.send(benchlib.HANDSHAKE)
+            sent[s] = time.monotonic()
+            socks.append(s)
+            sel.register(s, selectors.EVENT_READ)
+        while len(latency) < n:
+            for key, mask in sel.select(timeout):
+                key.fileobj.recv(4096)
+                sel.unregister(key.fileobj)
+                latency.append(time.monotonic() - sent[key.fileobj])
+        accept_time = time.monotonic() - start
+        latency.sort()
+        wait_for(counter, n, timeout)
+
+        # frame handling: every bridge sends one 6803d6 payload per round
+        start = time.monotonic()
+        for r in range(rounds):
+            for s in socks:
+                s.send(benchlib.PAYLOAD)
+            wait_for(counter, n * (r + 2), timeout)
+        frame_time = time.monotonic() - start
+    finally:
+        for s in socks:
+            s.close()
+        proc.terminate()
+        proc.join()
+    print('%6d bridges: accept+handshake %8.0f conn/s (p99 %6.1f ms), payload %8.0f frames/s'
+          % (n, n / accept_time, latency[int(n * 0.99) - 1] * 1000, n * rounds / frame_time))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('bench_eventloop')
+    parser.add_argument('--connections', type=int, nargs='+', default=[1000, 5000, 10000])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--forward', help='forward to HOST:PORT, e.g. an unreachable portal', type=str, default=None)
+    args = parser.parse_args()
+    forward_to = (None, None)
+    if args.forward:
+        host, port = args.forward.rsplit(':', 1)
+        forward_to = (host, int(port))
+    benchlib.raise_nofile()
+    for n in args.connections:
+        run(n, args.rounds, args.timeout, forward_to)
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# Runs enverproxy.py against a simulated bridge fleet, a fake MQTT broker and a stub portal
+#
+#   python3 bench/bench_fleet.py --bridges 1000 --converters 4 --interval 1 [--forward]
+#
+# Reports handshake latency percentiles, frames/s, MQTT publishes/s, CPU and RSS of the proxy.
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchlib
+import loadgen
+from fakes import FakeBroker, StubPortal, listen
+
+
+def free_port():
+    s = listen()
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def proc_stats(pid):
+    # (cpu seconds, rss in MB) of a process and its workers
+    with open('/proc/' + str(pid) + '/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    try:
+        with open('/proc/' + str(pid) + '/task/' + str(pid) + '/children') as f:
+            children = [int(c) for c in f.read().split()]
+    except OSError:
+        children = []
+    for child in children:
+        c, r = proc_stats(child)
+        cpu += c
+        rss += r
+    return cpu, rss
+
+
+def write_config(path, port, broker, portal, args):
+    with open(os.path.join(benchlib.ROOT, 'enverproxy.conf')) as f:
+        lines = f.read().split('\n')
+    settings = {
+        'listen_port': port,
+        'verbosity': args.verbosity,
+        'log_type': 'sys.stderr',
+        'mqtthost': '127.0.0.1',
+        'mqttport': broker.port,
+        'forward_IP': '127.0.0.1' if args.forward else 'None',
+        'forward_port': portal.port,
+        'total_calculate': 'True',
+        # loadgen resends identical payloads, which dedup would not publish
+        'dedup_window': 0,
+    }
+    for i, line in enumerate(lines):
+        key = line.split('=', 1)[0].strip()
+        if '=' in line and key in settings:
+            lines[i] = key + ' = ' + str(settings.pop(key))
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def start_proxy(conf, port, workers):
+    # Start enverproxy.py and wait until it accepts connections
+    proxy = subprocess.Popen([sys.executable, os.path.join(benchlib.ROOT, 'enverproxy.py'), '--config', conf, '--workers', str(workers)],
+                             stderr=subprocess.DEVNULL)
+    end = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return proxy
+        except OSError:
+            if time.monotonic() > end:
+                proxy.terminate()
+                proxy.wait()
+                raise
+            time.sleep(0.05)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('bench_fleet')
+    parser.add_argument('--bridges', type=int, default=1000)
+    parser.add_argument('--converters', type=int, default=4)
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--processes', type=int, default=1, help='load generator processes')
+    parser.add_argument('--workers', type=int, default=1, help='enverproxy --workers')
+    parser.add_argument('--verbosity', type=int, default=1)
+    parser.add_argument('--forward', action='store_true', help='forward to the stub portal')
+    args = parser.parse_args()
+    benchlib.raise_nofile()
+
+    broker = FakeBroker().start()
+    portal = StubPortal().start()
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        conf = os.path.join(tmp, 'enverproxy.conf')
+        write_config(conf, port, broker, portal, args)
+        proxy = start_proxy(conf, port, args.workers)
+        try:
+            cpu0, rss0 = proc_stats(proxy.pid)
+            published0 = broker.published.value
+            start = time.monotonic()
+            latency, payloads, errors, connect_time = loadgen.run('127.0.0.1', port, args.bridges, args.converters, args.interval, args.seconds, args.processes)
+            elapsed = time.monotonic() - start
+            cpu1, rss1 = proc_stats(proxy.pid)
+            published = broker.published.value - published0
+        finally:
+            proxy.terminate()
+            proxy.wait()
+            broker.stop()
+            portal.stop()
+
+    print('bridges %d x %d converters, payload every %.1fs, %.0fs' % (args.bridges, args.converters, args.interval, args.seconds))
+    print('handshake latency  p50 %7.1f ms  p90 %7.1f ms  p99 %7.1f ms  max %7.1f ms' % tuple(
+        loadgen.percentile(latency, p) * 1000 for p in (50, 90, 99, 100)))
+    print('frames             %9.0f /s' % (payloads / elapsed))
+    print('mqtt publishes     %9.0f /s' % (published / elapsed))
+    print('proxy cpu          %9.1f %%' % ((cpu1 - cpu0) / elapsed * 100))
+    print('proxy rss          %9.1f MB' % rss1)
+    print('errors             %9d' % errors)
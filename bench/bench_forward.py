@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# Forwarding throughput and proxy CPU per MB, with and without splice()
+#
+#   python3 bench/bench_forward.py
+
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+import benchlib
+
+CHUNK = bytes(65536)
+
+
+def portal(conn, direction, counter):
+    # Stub envertecportal: sinks data (up) or sends as fast as possible (down)
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    s.listen(16)
+    conn.send(s.getsockname()[1])
+
+    def handle(c):
+        try:
+            while True:
+                if direction == 'up':
+                    n = len(c.recv(65536))
+                    if not n:
+                        return
+                    with counter.get_lock():
+                        counter.value += n
+                else:
+                    c.sendall(CHUNK)
+        except OSError:
+            pass
+
+    while True:
+        c, addr = s.accept()
+        threading.Thread(target=handle, args=(c,), daemon=True).start()
+
+
+def cpu_seconds(pid):
+    with open('/proc/' + str(pid) + '/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def run(direction, splice, seconds):
+    counter = multiprocessing.Value('q', 0)
+    parent, child = multiprocessing.Pipe()
+    up = multiprocessing.Process(target=portal, args=(child, direction, counter), daemon=True)
+    up.start()
+    port = parent.recv()
+    proc, proxy_port, published = benchlib.start_server(forward_to = ('127.0.0.1', port), splice = splice, buffer_size = 65536)
+    c = socket.create_connection(('127.0.0.1', proxy_port))
+    received = 0
+    cpu = cpu_seconds(proc.pid)
+    start = time.monotonic()
+    end = start + seconds
+    while time.monotonic() < end:
+        if direction == 'up':
+            c.sendall(CHUNK)
+        else:
+            received += len(c.recv(65536))
+    elapsed = time.monotonic() - start
+    cpu = cpu_seconds(proc.pid) - cpu
+    nbytes = counter.value if direction == 'up' else received
+    c.close()
+    proc.terminate()
+    up.terminate()
+    proc.join()
+    up.join()
+    mb = nbytes / 1e6
+    print('%-4s %-6s %8.1f MB/s %8.2f ms CPU/MB' % (direction, 'splice' if splice else 'copy', mb / elapsed, cpu / mb * 1000 if mb else 0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('bench_forward')
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+    run('up', False, args.seconds)
+    run('down', False, args.seconds)
+    run('down', True, args.seconds)
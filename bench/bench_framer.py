@@ -0,0 +1,34 @@
+#!/usr/bin/python3
+# Throughput of the Framer with the frames of the captured traces, tests/test_framer.py checks the reassembly
+#
+#   python3 bench/bench_framer.py
+
+import argparse
+import time
+
+import benchlib
+from framer import Framer
+
+
+def throughput(frames, chunk, seconds):
+    stream = b''.join(frames) * 100
+    chunks = [stream[i:i+chunk] for i in range(0, len(stream), chunk)]
+    framer = Framer()
+    count = 0
+    nbytes = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for c in chunks:
+            count += len(framer.feed(c))
+        nbytes += len(stream)
+    elapsed = time.perf_counter() - start
+    print('chunk %5d bytes: %9.0f frames/s %7.1f MB/s' % (chunk, count / elapsed, nbytes / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('bench_framer')
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+    frames = benchlib.trace_frames() + [benchlib.HANDSHAKE, benchlib.PAYLOAD]
+    for chunk in (1, 64, 1460, 4096, 65536):
+        throughput(frames, chunk, args.seconds)
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# Per-frame logging overhead of TheServer at every verbosity level
+#
+#   python3 bench/bench_slog.py
+
+import argparse
+import os
+import socket
+import sys
+import time
+
+import benchlib
+
+
+def per_frame(enverproxy, log, frames, seconds):
+    server = enverproxy.TheServer(host = '127.0.0.1', port = 0, forward_to = (None, None), log = log)
+    benchlib.attach_mqtt(server, benchlib.NullMqtt())
+    a, b = socket.socketpair()
+    conn = enverproxy.Connection(a, ('127.0.0.1', 0), True)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for f in frames:
+            server.on_recv(conn, f)
+        # drop the handshake replies
+        b.recv(65536)
+        count += len(frames)
+    elapsed = time.perf_counter() - start
+    a.close()
+    b.close()
+    server.server.close()
+    return elapsed / count * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('bench_slog')
+    parser.add_argument('--seconds', type=float, default=1.0)
+    parser.add_argument('--log_type', type=str, default='sys.stdout', help='sys.stdout (to /dev/null) or syslog')
+    args = parser.parse_args()
+    enverproxy = benchlib.import_enverproxy()
+    from slog import slog
+    report = sys.stderr
+    if args.log_type == 'sys.stdout':
+        sys.stdout = open(os.devnull, 'w')
+    frames = [benchlib.HANDSHAKE, benchlib.PAYLOAD]
+    print('verbosity   direct us/frame   queued us/frame', file=report)
+    for verbosity in range(1, 6):
+        result = []
+        for log_queue in (False, True):
+            log = slog('bench', verbosity, args.log_type, log_queue = log_queue)
+            result.append(per_frame(enverproxy, log, frames, args.seconds))
+            log.stop()
+        print('%9d %17.1f %17.1f' % (verbosity, result[0], result[1]), file=report)
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# Startup time of enverproxy.py: import profile (python -X importtime) and the time
+# from starting the process until a bridge gets its handshake reply, with the MQTT
+# broker reachable and unreachable.
+#
+#   python3 bench/bench_startup.py --runs 5
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchlib
+from bench_fleet import free_port, write_config
+from fakes import FakeBroker, StubPortal
+
+
+def import_profile(top):
+    # Cumulative import time in ms of enverproxy and its slowest imports
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import enverproxy'], cwd = benchlib.ROOT,
+                         stderr = subprocess.PIPE, text = True, check = True).stderr
+    imports = []
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative) / 1000, name.rstrip()))
+    total = next(ms for ms, name in imports if name.strip() == 'enverproxy')
+    # direct imports of enverproxy are indented by three spaces
+    direct = sorted((i for i in imports if name_depth(i[1]) == 1), reverse = True)[:top]
+    return total, direct, [name.strip() for ms, name in imports]
+
+
+def name_depth(name):
+    return (len(name) - len(name.lstrip(' '))) // 2
+
+
+def first_handshake(conf, port, timeout = 10):
+    # Seconds from starting the proxy until its first handshake reply
+    start = time.monotonic()
+    proxy = subprocess.Popen([sys.executable, os.path.join(benchlib.ROOT, 'enverproxy.py'), '--config', conf], stderr = subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                s = socket.create_connection(('127.0.0.1', port))
+                break
+            except OSError:
+                if time.monotonic() - start > timeout:
+                    raise
+                time.sleep(0.001)
+        s.sendall(benchlib.HANDSHAKE)
+        s.recv(4096)
+        elapsed = time.monotonic() - start
+        s.close()
+    finally:
+        proxy.terminate()
+        proxy.wait()
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('bench_startup')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8)
+    args = parser.parse_args()
+
+    total, direct, names = import_profile(args.top)
+    print('import enverproxy   %7.1f ms' % total)
+    for ms, name in direct:
+        print('  %-22s %7.1f ms' % (name.strip(), ms))
+    print('paho.mqtt imported  %s' % ('yes' if any(n.startswith('paho') for n in names) else 'no (lazy)'))
+
+    broker = FakeBroker().start()
+    portal = StubPortal().start()
+    options = argparse.Namespace(verbosity = 1, forward = False)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            conf = os.path.join(tmp, 'enverproxy.conf')
+            for label, mqtt_port in (('broker reachable', broker.port), ('broker unreachable', free_port())):
+                times = []
+                for run in range(args.runs):
+                    port = free_port()
+                    broker.port = mqtt_port
+                    write_config(conf, port, broker, portal, options)
+                    times.append(first_handshake(conf, port))
+                print('start to first handshake reply, %-18s median %7.1f ms  max %7.1f ms'
+                      % (label, statistics.median(times) * 1000, max(times) * 1000))
+    finally:
+        broker.stop()
+        portal.stop()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# Reconnect storm: all bridges connect and send their handshake at the same time,
+# as after a portal or network outage, and repeat that for several rounds.
+# Each bridge uses its own 127.x.y.z address, so bridge status messages are
+# rate limited per bridge as in a real fleet.
+#
+#   python3 bench/bench_storm.py --bridges 1000 5000 --rounds 3 --bridge-interval 60
+
+import argparse
+import configparser
+import errno
+import selectors
+import socket
+import time
+
+import benchlib
+
+
+def address(i):
+    return '127.%d.%d.%d' % (1 + i // 62500, i // 250 % 250, i % 250 + 1)
+
+
+def storm(n, port, timeout):
+    # One round: returns the handshake latencies
+    sel = selectors.DefaultSelector()
+    start = time.monotonic()
+    socks = []
+    for i in range(n):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(False)
+        s.bind((address(i), 0))
+        err = s.connect_ex(('127.0.0.1', port))
+        if err not in (0, errno.EINPROGRESS):
+            raise OSError(err, 'connect failed')
+        socks.append(s)
+        sel.register(s, selectors.EVENT_WRITE)
+    latency = []
+    end = start + timeout
+    while len(latency) < n:
+        if time.monotonic() > end:
+            raise TimeoutError(str(len(latency)) + ' of ' + str(n) + ' handshakes answered')
+        for key, mask in sel.select(1):
+            s = key.fileobj
+            if mask & selectors.EVENT_WRITE:
+                s.send(benchlib.HANDSHAKE)
+                sel.modify(s, selectors.EVENT_READ)
+            else:
+                if len(s.recv(4096)) != len(benchlib.HANDSHAKE):
+                    raise ValueError('unexpected handshake reply')
+                sel.unregister(s)
+                latency.append(time.monotonic() - start)
+    for s in socks:
+        s.close()
+    sel.close()
+    latency.sort()
+    return latency
+
+
+def run(n, rounds, bridge_interval, timeout):
+    config = configparser.ConfigParser()
+    config['enverproxy'] = {'mqtt_bridge_interval': str(bridge_interval)}
+    proc, port, counter = benchlib.start_server(config = config)
+    try:
+        for r in range(rounds):
+            published = counter.value
+            latency = storm(n, port, timeout)
+            # let the server finish the publishes of the last handshakes
+            time.sleep(0.2)
+            print('%6d bridges round %d: %8.0f handshakes/s, p50 %7.1f ms, p99 %7.1f ms, %6d bridge status messages'
+                  % (n, r + 1, n / latency[-1], latency[n // 2] * 1000, latency[int(n * 0.99) - 1] * 1000, counter.value - published))
+            time.sleep(0.5)
+    finally:
+        proc.terminate()
+        proc.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('bench_storm')
+    parser.add_argument('--bridges', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--bridge-interval', help='mqtt_bridge_interval of the proxy', type=float, default=60)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+    benchlib.raise_nofile()
+    for n in args.bridges:
+        run(n, args.rounds, args.bridge_interval, args.timeout)
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# Payload throughput of enverproxy.py --workers 1..N, counted at a fake MQTT broker
+#
+#   python3 bench/bench_workers.py --workers 1 2 4
+#
+# The workers share the listen port and report to the aggregator, which publishes
+# the fleet total, so every payload results in one message per converter plus one total.
+
+import argparse
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+
+import benchlib
+from bench_fleet import free_port, start_proxy, write_config
+from fakes import FakeBroker, StubPortal
+
+
+def bridges(port, n, stop):
+    # n bridges sending 6803d6 payloads as fast as the proxy takes them
+    socks = []
+    for i in range(n):
+        s = socket.create_connection(('127.0.0.1', port))
+        s.send(benchlib.HANDSHAKE)
+        s.recv(4096)
+        socks.append(s)
+    # converter ids read as decimal numbers in hex, like loadgen and the devices
+    frame = benchlib.payload([int(str(w), 16) for w in range(10000001, 10000011)])
+    while not stop.is_set():
+        for s in socks:
+            s.send(frame)
+    for s in socks:
+        s.close()
+
+
+def run(workers, args):
+    broker = FakeBroker().start()
+    portal = StubPortal().start()
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        conf = os.path.join(tmp, 'enverproxy.conf')
+        write_config(conf, port, broker, portal, args)
+        proxy = start_proxy(conf, port, workers)
+        stop = multiprocessing.Event()
+        load = [multiprocessing.Process(target=bridges, args=(port, args.connections // args.clients, stop)) for i in range(args.clients)]
+        try:
+            for p in load:
+                p.start()
+            # skip the connection phase
+            time.sleep(1)
+            published0 = broker.published.value
+            start = time.monotonic()
+            time.sleep(args.seconds)
+            rate = (broker.published.value - published0) / (time.monotonic() - start)
+        finally:
+            stop.set()
+            for p in load:
+                p.join()
+            proxy.terminate()
+            proxy.wait()
+            broker.stop()
+            portal.stop()
+    return rate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('bench_workers')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=os.cpu_count(), help='load generator processes')
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--verbosity', type=int, default=1)
+    parser.add_argument('--forward', action='store_true', help='forward to the stub portal')
+    args = parser.parse_args()
+    benchlib.raise_nofile()
+    print('cpus: ' + str(os.cpu_count()))
+    base = None
+    for n in args.workers:
+        rate = run(n, args)
+        base = base or rate
+        print('%3d workers: %9.0f publishes/s  scaling %.2fx' % (n, rate, rate / base))
@@ -0,0 +1,111 @@
+# Helpers shared by the benchmark scripts in this directory
+
+import multiprocessing
+import os
+import re
+import resource
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Frames as sent by an EnvertecBridge (see test_client.py and trace/)
+HANDSHAKE = bytes.fromhex('680030681006900105970000000002000010022300027983220247200e84001c31661b3337e431fc0000000000003316')
+
+
+def payload(wrids = (0x11127983,)):
+    # Build a 982 byte 6803d6 frame with one 32 byte block per converter id
+    frame = bytearray(982)
+    frame[0:12] = bytes.fromhex('6803d6681004900105970000')
+    block = bytes.fromhex('2202479b0093001d1df91a19388e32050244010000000000')
+    for i, wrid in enumerate(wrids):
+        pos = 20 + i * 32
+        frame[pos:pos+4] = wrid.to_bytes(4, 'big')
+        frame[pos+4:pos+28] = block
+    frame[-2] = 0xa1
+    frame[-1] = 0x16
+    return bytes(frame)
+
+
+PAYLOAD = payload()
+
+
+def trace_frames(name = 'trace of successful transmission.txt'):
+    # Payloads of a wireshark trace in trace/, one frame per 'Payload' entry
+    frames = []
+    current = None
+    with open(os.path.join(ROOT, 'trace', name)) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('Payload'):
+                if current:
+                    frames.append(bytes.fromhex(current))
+                current = line[len('Payload'):].replace(' ', '')
+            elif current != None and re.fullmatch('[0-9a-f ]+', line):
+                current += line.replace(' ', '')
+            elif current:
+                frames.append(bytes.fromhex(current))
+                current = None
+    if current:
+        frames.append(bytes.fromhex(current))
+    return frames
+
+
+def import_enverproxy():
+    import enverproxy
+    return enverproxy
+
+
+def raise_nofile():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+class NullMqtt:
+    # Stand-in for paho.mqtt.client.Client that only counts publishes
+    def __init__(self, counter = None):
+        self.counter = counter
+        self.published = 0
+
+    def publish(self, topic, payload = None, qos = 0, retain = False):
+        self.published += 1
+        if self.counter != None:
+            with self.counter.get_lock():
+                self.counter.value += 1
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+
+def attach_mqtt(server, client):
+    # Use client instead of a connection to a broker
+    server.mqtt = client
+    server.publisher.mqtt = client
+
+
+def _serve(conn, counter, port, forward_to, kwargs):
+    raise_nofile()
+    enverproxy = import_enverproxy()
+    from slog import slog
+    log = slog('bench', verbosity = 1, log_type = 'sys.stderr')
+    server = enverproxy.TheServer(host = '127.0.0.1', port = port, forward_to = forward_to, log = log, **kwargs)
+    attach_mqtt(server, NullMqtt(counter))
+    conn.send(server.server.getsockname()[1])
+    conn.close()
+    server.main_loop()
+
+
+def start_server(forward_to = (None, None), port = 0, counter = None, **kwargs):
+    # Run TheServer in a child process, returns (process, port, publish counter)
+    if counter == None:
+        counter = multiprocessing.Value('q', 0)
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=_serve, args=(child, counter, port, forward_to, kwargs), daemon=True)
+    proc.start()
+    port = parent.recv()
+    return proc, port, counter
@@ -0,0 +1,142 @@
+# Stand-ins for the MQTT broker and envertecportal.com used by the benchmarks
+
+import multiprocessing
+import selectors
+import socket
+
+import benchlib  # noqa: F401, puts the proxy modules on sys.path
+from framer import Framer
+
+
+def listen(port = 0):
+    s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(('127.0.0.1', port))
+    s.listen(socket.SOMAXCONN)
+    s.setblocking(False)
+    return s
+
+
+def serve(server, handler):
+    # Minimal event loop: handler(sock, buffer, data) is called for received data
+    sel = selectors.DefaultSelector()
+    sel.register(server, selectors.EVENT_READ, None)
+    while True:
+        for key, mask in sel.select():
+            if key.data == None:
+                try:
+                    c, addr = server.accept()
+                except BlockingIOError:
+                    continue
+                sel.register(c, selectors.EVENT_READ, [bytearray()])
+                continue
+            try:
+                data = key.fileobj.recv(65536)
+            except OSError:
+                data = b''
+            if not data:
+                sel.unregister(key.fileobj)
+                key.fileobj.close()
+                continue
+            handler(key.fileobj, key.data, data)
+
+
+class FakeBroker:
+
+    # MQTT 3.1.1 broker that accepts every client and counts PUBLISH packets.
+    # Nothing is delivered to subscribers.
+
+    def __init__(self):
+        self.published = multiprocessing.Value('q', 0)
+        self.server = listen()
+        self.port = self.server.getsockname()[1]
+
+    def handle(self, sock, state, data):
+        buf = state[0]
+        buf += data
+        pos = 0
+        published = 0
+        while len(buf) - pos >= 2:
+            # fixed header: type, remaining length as varint
+            length = 0
+            shift = 0
+            i = pos + 1
+            while i < len(buf):
+                length |= (buf[i] & 0x7f) << shift
+                shift += 7
+                i += 1
+                if not buf[i-1] & 0x80:
+                    break
+            else:
+                break
+            if len(buf) < i + length:
+                break
+            ptype = buf[pos] >> 4
+            if ptype == 1:
+                # CONNECT -> CONNACK
+                sock.send(b'\x20\x02\x00\x00')
+            elif ptype == 3:
+                published += 1
+                qos = (buf[pos] >> 1) & 3
+                if qos:
+                    # PUBACK / PUBREC with the packet id behind the topic
+                    tlen = (buf[i] << 8) | buf[i+1]
+                    pid = bytes(buf[i+2+tlen:i+4+tlen])
+                    sock.send((b'\x40\x02' if qos == 1 else b'\x50\x02') + pid)
+            elif ptype == 6:
+                # PUBREL -> PUBCOMP
+                sock.send(b'\x70\x02' + bytes(buf[i:i+2]))
+            elif ptype == 8:
+                # SUBSCRIBE -> SUBACK
+                sock.send(b'\x90\x03' + bytes(buf[i:i+2]) + b'\x00')
+            elif ptype == 12:
+                # PINGREQ -> PINGRESP
+                sock.send(b'\xd0\x00')
+            pos = i + length
+        del buf[:pos]
+        if published:
+            with self.published.get_lock():
+                self.published.value += published
+
+    def start(self):
+        self.process = multiprocessing.Process(target=serve, args=(self.server, self.handle), daemon=True)
+        self.process.start()
+        self.server.close()
+        return self
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+
+class StubPortal:
+
+    # Answers like envertecportal.com: 680030681007 for a handshake and an
+    # 18 byte 680012681015 acknowledge for every payload frame
+
+    def __init__(self):
+        self.frames = multiprocessing.Value('q', 0)
+        self.server = listen()
+        self.port = self.server.getsockname()[1]
+
+    def handle(self, sock, state, data):
+        if len(state) == 1:
+            state.append(Framer())
+        frames = state[1].feed(data)
+        for frame in frames:
+            if frame[:6] == b'\x68\x00\x30\x68\x10\x06':
+                sock.send(frame[:5] + b'\x07' + frame[6:])
+            elif frame[:3] == b'\x68\x03\xd6' or frame[:3] == b'\x68\x00\x56':
+                sock.send(b'\x68\x00\x12\x68\x10\x15' + frame[6:10] + bytes(6) + b'\x89\x16')
+        with self.frames.get_lock():
+            self.frames.value += len(frames)
+
+    def start(self):
+        self.process = multiprocessing.Process(target=serve, args=(self.server, self.handle), daemon=True)
+        self.process.start()
+        self.server.close()
+        return self
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+# Simulated fleet of EnvertecBridges: every bridge connects, does the 680030
+# handshake and then sends a 6803d6 payload for its converters periodically
+#
+#   python3 bench/loadgen.py --port 1898 --bridges 1000 --converters 4 --interval 1
+
+import argparse
+import heapq
+import multiprocessing
+import random
+import selectors
+import socket
+import time
+
+import benchlib
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def fleet(host, port, bridges, converters, interval, seconds, first_id, result):
+    # One load generator process, results are put into the result queue
+    sel = selectors.DefaultSelector()
+    schedule = []
+    frames = {}
+    sent = {}
+    latency = []
+    payloads = 0
+    errors = 0
+    rnd = random.Random(first_id)
+    start = time.monotonic()
+    for b in range(bridges):
+        try:
+            s = socket.create_connection((host, port))
+        except OSError:
+            errors += 1
+            continue
+        s.setblocking(False)
+        wrid = first_id + b * converters
+        # converter ids read as decimal numbers in hex, like the ids printed on the devices
+        frames[s] = benchlib.payload([int(str(w), 16) for w in range(wrid, wrid + converters)])
+        sel.register(s, selectors.EVENT_READ)
+        sent[s] = time.monotonic()
+        s.send(benchlib.HANDSHAKE)
+    connect_time = time.monotonic() - start
+    end = time.monotonic() + seconds
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            break
+        timeout = end - now
+        if schedule:
+            timeout = min(timeout, max(0, schedule[0][0] - now))
+        for key, mask in sel.select(timeout):
+            s = key.fileobj
+            try:
+                data = s.recv(65536)
+            except OSError:
+                data = b''
+            if not data:
+                sel.unregister(s)
+                errors += 1
+                continue
+            if s in sent and data[:6] == b'\x68\x00\x30\x68\x10\x07':
+                latency.append(time.monotonic() - sent.pop(s))
+                # spread the payloads of the fleet over the interval
+                heapq.heappush(schedule, (time.monotonic() + rnd.random() * interval, s.fileno(), s))
+        now = time.monotonic()
+        while schedule and schedule[0][0] <= now:
+            t, fd, s = heapq.heappop(schedule)
+            try:
+                s.send(frames[s])
+                payloads += 1
+            except OSError:
+                errors += 1
+                continue
+            heapq.heappush(schedule, (t + interval, fd, s))
+    for s in frames:
+        s.close()
+    result.put((latency, payloads, errors, connect_time))
+
+
+def run(host, port, bridges, converters, interval, seconds, processes = 1):
+    # Returns handshake latencies, payloads sent, errors and connect time of the whole fleet
+    result = multiprocessing.Queue()
+    share = bridges // processes
+    procs = []
+    for p in range(processes):
+        n = share if p < processes - 1 else bridges - share * (processes - 1)
+        first_id = 10000000 + p * share * converters
+        procs.append(multiprocessing.Process(target=fleet, args=(host, port, n, converters, interval, seconds, first_id, result)))
+    for p in procs:
+        p.start()
+    latency = []
+    payloads = 0
+    errors = 0
+    connect_time = 0.0
+    for p in procs:
+        l, n, e, c = result.get()
+        latency += l
+        payloads += n
+        errors += e
+        connect_time = max(connect_time, c)
+    for p in procs:
+        p.join()
+    return latency, payloads, errors, connect_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('loadgen')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1898)
+    parser.add_argument('--bridges', type=int, default=100)
+    parser.add_argument('--converters', type=int, default=4, help='converters per bridge (max 30)')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between two payloads of a bridge')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+    benchlib.raise_nofile()
+    latency, payloads, errors, connect_time = run(args.host, args.port, args.bridges, args.converters, args.interval, args.seconds, args.processes)
+    print('handshakes %d, p50 %.1f ms, p99 %.1f ms, payloads %.0f/s, errors %d'
+          % (len(latency), percentile(latency, 50) * 1000, percentile(latency, 99) * 1000, payloads / args.seconds, errors))
@@ -0,0 +1,109 @@
+import mmap
+import socket
+import struct
+import time
+from datetime import datetime
+from framer import Framer, HANDSHAKE, PAYLOAD, PAYLOAD_SHORT
+from slog import slog
+
+# Capture file: MAGIC followed by records of RECORD + frame
+#   time (float seconds since epoch), peer IPv4 address, peer port, frame length
+MAGIC  = b'ENVCAP1\n'
+RECORD = struct.Struct('>d4sHI')
+
+
+class Capture:
+
+    # Appends every frame received from a bridge to a capture file
+
+    def __init__(self, path, l = None):
+        if l == None:
+            self.__log = slog('Capture class')
+        else:
+            self.__log = l
+        self.path  = path
+        self.count = 0
+        self.__file = open(path, 'ab', buffering = 65536)
+        if self.__file.tell() == 0:
+            self.__file.write(MAGIC)
+        self.__log.logMsg('Capturing frames to ' + path, 2)
+
+    def write(self, addr, frame):
+        self.__file.write(RECORD.pack(time.time(), socket.inet_aton(addr[0]), addr[1], len(frame)))
+        self.__file.write(frame)
+        self.count += 1
+
+    def close(self):
+        self.__file.close()
+        self.__log.logMsg('Captured ' + str(self.count) + ' frames to ' + self.path, 2)
+
+
+def records(mm):
+    # Yields (time, (ip, port), frame) from a mapped capture file
+    if mm[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a capture file')
+    pos = len(MAGIC)
+    end = len(mm)
+    while pos + RECORD.size <= end:
+        t, ip, port, length = RECORD.unpack_from(mm, pos)
+        pos += RECORD.size
+        if pos + length > end:
+            # truncated by a crash while capturing
+            break
+        yield t, (socket.inet_ntoa(ip), port), mm[pos:pos+length]
+        pos += length
+
+
+class DiscardClient:
+    # MQTT client for --dry-run: messages are dropped
+    def publish(self, topic, payload = None, qos = 0, retain = False):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+
+class Replay:
+
+    # Streams a capture file through the framer, decoder, Total and publisher of server
+
+    def __init__(self, server, path, l = None):
+        if l == None:
+            self.__log = slog('Replay class')
+        else:
+            self.__log = l
+        self.__server = server
+        self.__path   = path
+
+    def run(self, speed = 0):
+        # speed 0 replays as fast as possible, 1 at recorded speed, 2 twice as fast ...
+        server  = self.__server
+        framers = {}
+        frames  = 0
+        first   = None
+        start   = time.monotonic()
+        with open(self.__path, 'rb') as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            for t, addr, data in records(mm):
+                if speed:
+                    if first == None:
+                        first = t
+                    delay = (t - first) / speed - (time.monotonic() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                framer = framers.get(addr)
+                if framer == None:
+                    framer = framers[addr] = Framer()
+                for frame in framer.feed(data):
+                    frames += 1
+                    kind = frame[:6]
+                    if kind == HANDSHAKE:
+                        server.publisher.bridge(addr[0], t, datetime.utcfromtimestamp(t))
+                    elif kind == PAYLOAD or kind == PAYLOAD_SHORT:
+                        server.process_data(frame)
+        elapsed = time.monotonic() - start
+        self.__log.logMsg('Replayed ' + str(frames) + ' frames from ' + str(len(framers)) + ' bridges in ' + '%.2f' % elapsed + 's ('
+                          + '%.0f' % (frames / elapsed if elapsed else 0) + ' frames/s)', 1)
+        return frames
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# test_client.py sends frames to envertecportal.com, it is not a test
+collect_ignore = ['test_client.py']
+
+# the tests share the frame helpers of the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
@@ -0,0 +1,41 @@
+import struct
+
+# Decodes the converter blocks of 6803d6 / 680056 payload frames
+#
+#               1        2                    4        4    5    5    6        6    7    7
+# 0      6      2        0                    0        8    2    6    0        8    2    6
+# -------------------------------------------------------------------------------------------
+# cmd    cmd    account                       wrid     ?    dc   pwr  totalkWh temp ac   F
+# -------------------------------------------------------------------------------------------
+# 6803d6 681004 yyyyyyyy 00000000000000000000 xxxxxxxx 2202 40d0 352b 001c5f39 1d66 3872 3204
+#
+# Offsets above are hex digits: the first block starts at byte 20 and every
+# converter occupies 32 bytes.
+
+HEADER    = 20
+BLOCK     = 32
+CONVERTER = struct.Struct('>4s2xHHIHHH12s')
+NO_ID     = bytes(4)
+
+
+def decode(data):
+    # Returns one dict per converter with a non zero id, decoded in place from data
+    count = (len(data) - HEADER) // BLOCK
+    if count <= 0:
+        return []
+    wr = []
+    with memoryview(data) as mv:
+        for wrid, dc, power, total, temp, ac, freq, remaining in CONVERTER.iter_unpack(mv[HEADER:HEADER + count * BLOCK]):
+            # Ignore if converter id is zero
+            if wrid != NO_ID:
+                wr.append({
+                    'wrid'      : wrid.hex(),
+                    'dc'        : dc / 512,
+                    'power'     : power / 64,
+                    'totalkwh'  : total / 8192,
+                    'temp'      : (temp / 128) - 40,
+                    'ac'        : ac / 64,
+                    'freq'      : (freq >> 8) + (freq & 0xff) / 256,
+                    'remaining' : remaining.hex(),
+                })
+    return wr
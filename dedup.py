@@ -0,0 +1,34 @@
+import time
+from collections import OrderedDict
+
+
+class Dedup:
+
+    # Recognizes payload frames a bridge sends again after reconnects and timeouts.
+    # Keeps the fingerprints (hash of the frame bytes) of the last size frames,
+    # least recently seen first. A frame is a duplicate if the same bridge sent
+    # identical bytes less than window seconds ago.
+
+    def __init__(self, window = 30.0, size = 4096):
+        self.window     = window
+        self.size       = size
+        self.__seen     = OrderedDict()
+
+    def __len__(self):
+        return len(self.__seen)
+
+    def duplicate(self, bridge, data, now = None):
+        if now == None:
+            now = time.monotonic()
+        seen = self.__seen
+        key = (bridge, hash(bytes(data)))
+        last = seen.get(key)
+        if last != None:
+            seen.move_to_end(key)
+            if now - last < self.window:
+                # the window starts with the first copy, so repeats do not extend it
+                return True
+        seen[key] = now
+        if len(seen) > self.size:
+            seen.popitem(last = False)
+        return False
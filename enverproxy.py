@@ -1,32 +1,67 @@
 #!/usr/bin/python3
 # This is a simple port-forward / proxy for EnvertecBridge
 
-import argparse
 import ast
 import configparser
+import contextlib
 import errno
+import heapq
 import json
 import os
-import paho.mqtt.client as mqtt
-import select
+import selectors
 import socket
 import signal
 import sys
 import syslog
+import threading
 import time
-from datetime import datetime
+import decoder
+from aggregator import Aggregator
+from analytics import Analytics
+from capture import Capture, DiscardClient, Replay
+from dedup import Dedup
+from framer import Framer, HANDSHAKE, HANDSHAKE_REPLY, PAYLOAD, PAYLOAD_SHORT
+from metrics import HttpServer, MetricsServer, stats
+from pipeline import Pipeline
+from publisher import Publisher
 from slog import slog
+from state import ApiServer, State
+from store import Store
+from upstream import Backoff, ForwardQueue
 
-argparser = argparse.ArgumentParser("Enverproxy");
-argparser.add_argument("--config", help="Path to config.", type=str, default="/etc/enverproxy.conf")
-args = argparser.parse_args()
 
-config = configparser.ConfigParser()
-config['internal']={}
-config['internal']['conf_file'] = args.config
-config['internal']['section']   = 'enverproxy'
-config['internal']['version']   = '1.4'
-config['internal']['keys']      = "['buffer_size', 'delay', 'listen_port', 'verbosity', 'log_type', 'log_address', 'log_port', 'forward_IP', 'forward_port', 'mqttuser', 'mqttpassword', 'mqtthost', 'mqttport']"
+def parse_args(argv = None):
+    # argparse is only needed when started from the command line
+    import argparse
+    argparser = argparse.ArgumentParser("Enverproxy");
+    argparser.add_argument("--config", help="Path to config.", type=str, default="/etc/enverproxy.conf")
+    argparser.add_argument("--workers", help="Number of worker processes sharing the listen port.", type=int, default=1)
+    argparser.add_argument("--replay", help="Replay a capture file instead of listening for bridges.", type=str, default=None)
+    argparser.add_argument("--replay-speed", help="0 replays as fast as possible, 1 at recorded speed.", type=float, default=0)
+    argparser.add_argument("--dry-run", help="Do not publish replayed data to MQTT.", action="store_true")
+    return argparser.parse_args(argv)
+
+
+def internal_config(conf_file):
+    # Configuration with the internal section, the file is read later
+    config = configparser.ConfigParser()
+    config['internal']={}
+    config['internal']['conf_file'] = conf_file
+    config['internal']['section']   = 'enverproxy'
+    config['internal']['version']   = '1.4'
+    config['internal']['keys']      = "['buffer_size', 'delay', 'listen_port', 'verbosity', 'log_type', 'log_address', 'log_port', 'forward_IP', 'forward_port', 'mqttuser', 'mqttpassword', 'mqtthost', 'mqttport']"
+    return config
+
+
+def process_age():
+    # Seconds since this process was started, None where /proc is missing
+    try:
+        with open('/proc/self/stat') as f:
+            start = int(f.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            return float(f.read().split()[0]) - start
+    except (OSError, ValueError, IndexError):
+        return None
 
 
 class Forward:
@@ -41,26 +76,107 @@ class Forward:
         if (host == None or port == None or host == 'None'):
             return False
         try:
-            self.forward.connect((host, port))
+            # connect in the background, the event loop waits for the socket to become writable
+            self.forward.setblocking(False)
+            err = self.forward.connect_ex((host, port))
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                raise OSError(err, os.strerror(err))
             return self.forward
         except OSError as e:
             self.__log.logMsg('Forward produced error: ' + str(e))
+            stats.upstream_failures += 1
+            self.forward.close()
             return False
 
+def read_config(internal):
+    # Parse the configuration file named in internal, raises ValueError if it cannot be used
+    new = configparser.ConfigParser()
+    new['internal'] = dict(internal)
+    if not new.read(internal['conf_file']):
+        raise ValueError('Configuration file ' + internal['conf_file'] + ' not found')
+    section = internal['section']
+    if section not in new:
+        raise ValueError('Section ' + section + ' is missing in config file ' + internal['conf_file'])
+    for k in ast.literal_eval(internal['keys']):
+        if k not in new[section]:
+            raise ValueError('Config variable "' + k + '" is missing in config file ' + internal['conf_file'])
+    # raise on values that cannot be converted
+    log_settings(new)
+    mqtt_settings(new)
+    int(new[section]['forward_port'])
+    return new
+
+
+def log_settings(config):
+    c = config['enverproxy']
+    return {'verbosity': int(c['verbosity']), 'log_type': c['log_type'], 'log_address': c['log_address'],
+            'log_port': int(c['log_port']), 'log_queue': c.get('log_queue', 'False') == 'True'}
+
+
+def mqtt_settings(config):
+    c = config['enverproxy']
+    return (c['mqtthost'], c['mqttuser'], c['mqttpassword'], int(c['mqttport']))
+
+
+def connect_mqtt(host, user, password, port, client_id = 'enverproxy'):
+    # The client connects (and reconnects) in its network thread once loop_start()
+    # is called, nobody waits for the broker. paho is imported on first use, it
+    # is the largest part of the startup time.
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1, client_id=client_id)
+    if (user != None or password != None):
+        client.username_pw_set(user, password)
+    client.connect_async(host, port)
+    return client
+
+
+def stop_mqtt(client):
+    client.disconnect()
+    client.loop_stop()
+
+
+def reconnect_mqtt(publisher, settings, client_id):
+    # Replace the MQTT client of publisher by a new connection. The old client is
+    # stopped in the background, loop_stop() waits for its network thread, up to
+    # the connect timeout if the old broker cannot be reached.
+    client = connect_mqtt(*settings, client_id)
+    old = publisher.mqtt
+    publisher.attach(client)
+    client.loop_start()
+    if old:
+        threading.Thread(target = stop_mqtt, args = (old,), name = 'mqtt-stop', daemon = True).start()
+    return client
+
+
 class Total:
     def __init__(self, l=None, config = None):
         if l == None:
             self.__log = slog('Total class')
         else:
             self.__log = l
-        self.__calculate = False
+        self.calculate = False
+        self.total_TTL = 300
+        self.total_phase_map = None
+        # converter id -> phase, precomputed from total_phase_map
+        self.__phase = {}
 
-        if not config:
-            return
-        if config['enverproxy'].get('total_calculate', 'False') != 'True':
-            return
+        # id -> [power, ttl, phase] of active converters
+        self.devices = {}
+        # (ttl, id) of every update, the oldest expires first
+        self.__expiry = []
+        # running sums over self.devices. Power values are multiples of 1/64,
+        # so adding and subtracting them does not accumulate rounding errors.
+        self.power = 0.0
+        self.phases = {'L1': 0.0, 'L2': 0.0, 'L3': 0.0}
+
+        if config:
+            self.configure(config)
 
-        self.__calculate = True
+    def configure(self, config):
+        # Also called on reload: active converters are kept and moved to their phase in the new map
+        self.calculate = config['enverproxy'].get('total_calculate', 'False') == 'True'
+        if not self.calculate:
+            return
         self.total_TTL = int(config['enverproxy'].get('total_TTL', 300))
 
         pm = config['enverproxy'].get('total_phase_map', None)
@@ -73,66 +189,107 @@ class Total:
         else:
             self.total_phase_map = None
 
-        self.devices = {}
+        phase_of = {}
+        if self.total_phase_map:
+            for phase in ('L1', 'L2', 'L3'):
+                for id in self.total_phase_map.get(phase, []):
+                    phase_of[id] = phase
+        phases = {'L1': 0.0, 'L2': 0.0, 'L3': 0.0}
+        for id, d in self.devices.items():
+            d[2] = phase_of.get(id)
+            if d[2]:
+                phases[d[2]] += d[0]
+        self.__phase = phase_of
+        self.phases = phases
+
+    def __expire(self, now):
+        # Subtract and remove converters whose ttl has passed, each exactly once
+        while self.__expiry and self.__expiry[0][0] <= now:
+            ttl, id = heapq.heappop(self.__expiry)
+            d = self.devices.get(id)
+            if d and d[1] == ttl:
+                # no newer update of this converter
+                del self.devices[id]
+                self.power -= d[0]
+                if d[2]:
+                    self.phases[d[2]] -= d[0]
+                self.__log.logMsg(lambda: 'Microconverter with ID ' + str(id) + ' expired', 4)
 
     def data(self, wrdata):
-        if not self.__calculate:
+        if not self.calculate:
             self.__log.logMsg('Total calc: disabled ', 3)
             return None
         self.__log.logMsg('Total calc: enabled ', 3)
+        now = int(time.time())
+        ttl = now + self.total_TTL
         for wrdict in wrdata:
             id = int(wrdict['wrid'])
-            d = self.devices.get(id, {})
-            entry = {
-                'power': wrdict['power'],
-                'ttl': int(time.time()) + self.total_TTL
-            }
-
-            if self.total_phase_map:
-                if d:
-                    entry['phase'] = d['phase']
-                else:
-                    if (id in self.total_phase_map.get('L1', [])):
-                        entry['phase'] = 'L1'
-                    elif (id in self.total_phase_map.get('L2', [])):
-                        entry['phase'] = 'L2'
-                    elif (id in self.total_phase_map.get('L3', [])):
-                        entry['phase'] = 'L3'
-                    else:
-                        entry['phase'] = None
+            power = wrdict['power']
+            d = self.devices.get(id)
+            if d:
+                self.power += power - d[0]
+                if d[2]:
+                    self.phases[d[2]] += power - d[0]
+                d[0] = power
+                if d[1] != ttl:
+                    d[1] = ttl
+                    heapq.heappush(self.__expiry, (ttl, id))
+            else:
+                phase = self.__phase.get(id)
+                if self.total_phase_map and not phase:
+                    self.__log.logMsg(lambda: 'Microconverter with ID ' + str(id) + ' was not found in total_phase_map', 2)
+                self.devices[id] = [power, ttl, phase]
+                self.power += power
+                if phase:
+                    self.phases[phase] += power
+                heapq.heappush(self.__expiry, (ttl, id))
 
-            self.devices[id] = entry
+        self.__expire(now)
+        count = len(self.devices)
+        power = self.power
 
-        power = 0.0
-        count = 0
-        now = int(time.time())
+        self.__log.logMsg(lambda: 'Total active converters: ' + str(count) + ' power: ' + str(power), 3)
 
-        phases = {'L1': {'power': 0.0,}, 'L2': {'power': 0.0,}, 'L3': {'power': 0.0,}} if self.total_phase_map else None
+        msg = {'count': count, 'grid': {'power': power}}
+        if self.total_phase_map:
+            msg['grid'].update({phase: {'power': p} for phase, p in self.phases.items()})
+        return msg
 
-        for key, value in self.devices.items():
-            if value['ttl'] > now:
-                count += 1
-                power += value['power']
-                if phases:
-                    phase = value.get('phase', None)
-                    if phase:
-                        phases[phase]['power'] += value['power']
-                    else:
-                        self.__log.logMsg('Microconverter with ID ' + str(key) + ' was not found in total_phase_map', 2)
 
-        self.__log.logMsg('Total active converters: ' + str(count) + ' power: ' + str(power), 3)
+class Connection:
+    # Per-socket state of the event loop, one object for every registered socket
+    __slots__ = ('sock', 'addr', 'client', 'peer', 'connecting', 'framer', 'wbuf', 'pipe', 'piped', 'paused', 'events')
 
-        msg = {'count': count, 'grid': {'power': power}}
-        if phases:
-            msg['grid'].update(phases)
-        return msg
+    def __init__(self, sock, addr, client, peer = None):
+        self.sock    = sock
+        self.addr    = addr
+        self.client  = client
+        self.peer    = peer
+        # upstream connect has not finished yet
+        self.connecting = False
+        # reassembles frames sent by a bridge, only clients are decoded
+        self.framer  = Framer() if client else None
+        # data waiting to be written to sock
+        self.wbuf    = bytearray()
+        # (read fd, write fd) of the pipe used to splice data from the peer, and its fill level
+        self.pipe    = None
+        self.piped   = 0
+        # reading is suspended while the peer cannot write fast enough
+        self.paused  = False
+        # selector events sock is registered for, 0 if not registered
+        self.events  = 0
 
+    def __repr__(self):
+        return ('client' if self.client else 'upstream') + str(self.addr)
 
-class TheServer:
-    input_list = []
-    channel = {}
 
-    def __init__(self, host, port, forward_to, delay = 0.0001, buffer_size = 4096, log = None, config = None):
+class TheServer:
+    def __init__(self, host, port, forward_to, delay = 0.0001, buffer_size = 4096, log = None, config = None, forward_timeout = 5.0, reuse_port = False,
+                 splice = False, high_water = 65536, low_water = 16384, metrics_port = None, metrics_address = '127.0.0.1', capture = None,
+                 store = None, api_port = None, api_address = '127.0.0.1', dedup_window = 0,
+                 pipeline_threads = 0, pipeline_queue = 1024, pipeline_policy = 'drop-oldest',
+                 forward_pool = 0, forward_reuse = 0.0, forward_max = 0, forward_backoff = 0.0, forward_backoff_max = 60.0,
+                 forward_queue = None, analytics = None):
         if log == None:
             self.__log = slog('TheServer class')
         else:
@@ -140,214 +297,661 @@ class TheServer:
         self.__delay       = delay
         self.__buffer_size = buffer_size
         self.__forward_to  = forward_to
+        self.__forward_timeout = forward_timeout
+        # (deadline, id, connection) of upstream connects in progress
+        self.__connecting  = []
+        # portal -> bridge traffic is moved with splice() without copying it into python
+        self.__splice      = splice and hasattr(os, 'splice')
+        # reading from a peer stops above high_water bytes queued for writing and resumes below low_water
+        self.__high_water  = high_water
+        self.__low_water   = low_water
+        # pre-warmed upstream connections without a client
+        self.__forward_pool = forward_pool
+        self.__idle        = {}
+        # upstream connections kept for forward_reuse seconds after their bridge left,
+        # bridge ip -> connection and connection -> [bridge ip, time to close]
+        self.__forward_reuse = forward_reuse
+        self.__held        = {}
+        self.__held_ip     = {}
+        # (time to close, id, connection) of held connections
+        self.__timers      = []
+        # number of upstream sockets and their limit, 0 is unlimited
+        self.__upstreams   = 0
+        self.__forward_max = forward_max
+        self.__backoff     = Backoff(forward_backoff, forward_backoff_max)
+        # store and forward: bridges are never connected to the portal directly, their
+        # frames are queued and delivered over connections held per bridge ip
+        self.forward_queue = forward_queue
+        # bridge ips with queued frames but no connection
+        self.__waiting     = set()
         self.__port        = port
         self.__host        = host
+        self.__open        = set()
         self.server        = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # several worker processes listen on the same port, the kernel balances connections
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server.bind((host, port))
-        self.server.listen(200)
+        self.server.listen(socket.SOMAXCONN)
+        self.server.setblocking(False)
+        # selectors picks epoll/kqueue where available, so the number of
+        # connections is neither limited by FD_SETSIZE nor scanned per event
+        self.selector      = selectors.DefaultSelector()
         self.total = Total(log, config)
+        self.publisher = Publisher(log, config)
+        self.mqtt      = None
+        # the startup thread and reload both attach MQTT clients, one at a time
+        self.__mqtt_lock = threading.Lock()
+        self.__mqtt_settings = None
+        self.__client_id = 'enverproxy'
+        self.__config  = config
+        # SIGHUP only sets __reload and writes to __wakeup_w, the event loop then reloads the configuration
+        self.__reload  = False
+        self.__wakeup, self.__wakeup_w = socket.socketpair()
+        self.__wakeup.setblocking(False)
+        self.__wakeup_w.setblocking(False)
+        # Prometheus metrics endpoint, served by the event loop
+        self.metrics = MetricsServer(self, metrics_address, metrics_port, log) if metrics_port else None
+        # records the frames of all bridges for --replay
+        self.capture = capture
+        # local time series of converter readings
+        self.store = store
+        # derived per converter values, published every analytics.interval seconds
+        self.analytics = analytics
+        # payloads resent by a bridge within dedup_window seconds are forwarded but not processed again
+        self.dedup = Dedup(dedup_window) if dedup_window > 0 else None
+        # with pipeline_threads payloads are decoded and published outside of the event loop
+        self.pipeline = Pipeline(self, pipeline_threads, pipeline_queue, pipeline_policy, log) if pipeline_threads > 0 else None
+        # frame handlers by the first six bytes of a frame
+        self.__frames      = {HANDSHAKE: self.on_handshake, PAYLOAD: self.on_payload, PAYLOAD_SHORT: self.on_payload}
+        # latest readings, served as JSON by the event loop
+        self.state = State() if api_port else None
+        self.api = ApiServer(self, api_address, api_port, log) if api_port else None
 
-    def connect_mqtt(self, host, user, password, port):
-        self.mqtt = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1, client_id='enverproxy')
-        if (user != None or password != None):
-            self.mqtt.username_pw_set(user, password)
-        self.mqtt.connect(host, port)
+    def connect_mqtt(self, host, user, password, port, client_id = 'enverproxy'):
+        # Creating the client imports paho, which takes longer than the rest of the
+        # startup, so it runs in a thread. The publisher queues messages meanwhile.
+        self.__mqtt_settings = (host, user, password, port)
+        self.__client_id = client_id
+        self.publisher.connected = False
+        threading.Thread(target = self.__start_mqtt, name = 'mqtt-connect', daemon = True).start()
+
+    def __start_mqtt(self):
+        settings = self.__mqtt_settings
+        client = connect_mqtt(*settings, self.__client_id)
+        with self.__mqtt_lock:
+            if self.mqtt != None or settings != self.__mqtt_settings:
+                # a reload has attached a client for the new settings meanwhile,
+                # this one was never started
+                return
+            self.publisher.attach(client)
+            client.loop_start()
+            self.mqtt = client
+
+    def request_reload(self):
+        # Safe to call from a signal handler
+        self.__reload = True
+        try:
+            self.__wakeup_w.send(b'\0')
+        except OSError:
+            pass
+
+    def on_wakeup(self):
+        try:
+            while self.__wakeup.recv(64):
+                pass
+        except BlockingIOError:
+            pass
+        if self.__reload:
+            self.__reload = False
+            self.reload()
+
+    def reload(self):
+        # Re-read the configuration file and apply it. Open connections are not touched,
+        # the new forward_IP/forward_port is used for bridges connecting from now on.
+        start = time.perf_counter()
+        if not self.__config:
+            self.__log.logMsg('No configuration file to reload', 2)
+            return False
+        try:
+            config = read_config(self.__config['internal'])
+        except (ValueError, configparser.Error) as e:
+            self.__log.logMsg('Reload failed, keeping the current configuration: ' + str(e), 1)
+            return False
+        c = config['enverproxy']
+        # aggregation and publishing must not run in a pipeline thread meanwhile
+        with self.pipeline.lock if self.pipeline != None else contextlib.nullcontext():
+            self.__log.configure(**log_settings(config))
+            forward_to = (c['forward_IP'], int(c['forward_port']))
+            if forward_to != self.__forward_to:
+                self.__forward_to = forward_to
+                # pooled connections go to the previous portal
+                for upstream in list(self.__idle):
+                    self.__close_socket(upstream)
+            if isinstance(self.total, Total):
+                self.total.configure(config)
+            self.publisher.configure(config)
+            if self.analytics != None:
+                self.analytics.configure(config)
+            settings = mqtt_settings(config)
+            with self.__mqtt_lock:
+                if settings != self.__mqtt_settings:
+                    try:
+                        self.mqtt = reconnect_mqtt(self.publisher, settings, self.__client_id)
+                        self.__mqtt_settings = settings
+                    except OSError as e:
+                        self.__log.logMsg('Connecting to the new MQTT broker failed, keeping the current one: ' + str(e), 1)
+        self.__config = config
+        self.__log.logMsg('Reloaded configuration in ' + '%.1f' % ((time.perf_counter() - start) * 1000) + ' ms', 1)
+        return True
+
+    def connections(self):
+        # All open client and upstream connections
+        return list(self.__open)
 
     def main_loop(self):
-        self.input_list.append(self.server)
-        self.__log.logMsg('Starting mqtt loop', 5)
-        self.mqtt.loop_start()
-        self.__log.logMsg('mqtt loop started', 5)
+        self.selector.register(self.server, selectors.EVENT_READ, None)
+        self.selector.register(self.__wakeup, selectors.EVENT_READ, self.__wakeup)
+        if self.metrics:
+            self.metrics.start()
+        if self.api:
+            self.api.start()
+        if self.pipeline != None:
+            self.pipeline.start()
+        self.__fill_pool()
+        age = process_age()
+        if age != None:
+            self.__log.logMsg('Accepting connections on port ' + str(self.server.getsockname()[1]) + ' ' + '%.0f' % (age * 1000) + ' ms after start', 1)
         while True:
             self.__log.logMsg('Entering main loop', 5)
-            ss = select.select
-            inputready, outputready, exceptready = ss(self.input_list, [], [])
-            self.__log.logMsg('Inputready: ' + str(inputready), 3)
-            for self.s in inputready:
-                if self.s == self.server:
+            events = self.selector.select(self.__next_timeout())
+            if self.__log.enabled(3):
+                self.__log.logFmt('Inputready: %d sockets', len(events), vlevel = 3)
+            for key, mask in events:
+                conn = key.data
+                if conn == None:
                     # proxy server has new connection request
                     self.on_accept()
                     continue
-                # get the data
+                if conn is self.__wakeup:
+                    self.on_wakeup()
+                    continue
+                if isinstance(conn, HttpServer):
+                    conn.on_event(key.fileobj, mask)
+                    continue
+                if conn.sock.fileno() < 0:
+                    # closed earlier in this round together with its peer
+                    continue
+                if conn.connecting:
+                    # upstream connect has finished or failed
+                    self.on_connect(conn)
+                    continue
                 try:
-                    self.data = self.s.recv(self.__buffer_size)
-                    self.__log.logMsg('Main loop: ' + str(len(self.data)) + ' bytes received from ' + str(self.s.getpeername()), 4)
-                    if not self.data or len(self.data) == 0:
-                        # Client closed the connection
-                        self.on_close(self.s)
+                    if mask & selectors.EVENT_WRITE:
+                        self.on_write(conn)
+                    if not (mask & selectors.EVENT_READ and conn.events & selectors.EVENT_READ):
                         continue
+                    if self.__splice and not conn.client and conn.peer:
+                        # pass data from the portal to the bridge through the kernel
+                        if not self.splice(conn):
+                            self.on_close(conn)
+                        continue
+                    # get the data
+                    data = conn.sock.recv(self.__buffer_size)
+                    stats.recv_bytes += len(data)
+                    if self.__log.enabled(4):
+                        self.__log.logFmt('Main loop: %d bytes received from %s', len(data), conn.addr, vlevel = 4)
+                    if not data:
+                        # Client closed the connection
+                        self.on_close(conn)
                     else:
-                        self.on_recv()
-                except OSError as e:
-                    self.__log.logMsg('Main loop socket error: ' + str(e), 3)
-                    time.sleep(1) 
-                    if e.errno in (errno.ENOTCONN, errno.ECONNRESET):
-                        # Connection was closed abnormally
-                        self.on_close(self.s)
-                else:
+                        self.on_recv(conn, data)
+                except BlockingIOError:
                     continue
+                except OSError as e:
+                    # Connection was closed abnormally
+                    self.__log.logFmt('Main loop socket error: %s', e, vlevel = 3)
+                    self.on_close(conn)
+            self.__maintain()
 
-    def on_accept(self):
-        self.__log.logMsg('Entering on_accept', 5)
-        forward = Forward(self.__log).start(self.__forward_to[0], self.__forward_to[1])
-        clientsock, clientaddr = self.server.accept()
-        self.__log.logMsg(str(clientaddr) + ' has connected', 3)
-        self.input_list.append(clientsock)
-        if forward:
-            self.input_list.append(forward)
-            self.__log.logMsg('New connection list: ' + str(self.input_list), 5)
-            self.channel[clientsock] = forward
-            self.channel[forward] = clientsock
-            self.__log.logMsg('New channel dictionary: ' + str(self.channel), 5)
+    def __next_timeout(self):
+        # Time until the next upstream connect times out, a held connection is due or
+        # a connection attempt may be retried, None to wait for events only
+        while self.__connecting and not self.__connecting[0][2].connecting:
+            heapq.heappop(self.__connecting)
+        deadlines = []
+        if self.__connecting:
+            deadlines.append(self.__connecting[0][0])
+        if self.__timers:
+            deadlines.append(self.__timers[0][0])
+        if (self.__waiting or len(self.__idle) < self.__forward_pool) and not self.__backoff.ready(background = True):
+            deadlines.append(self.__backoff.background)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def __maintain(self):
+        # Timers of the event loop, run after every round of events
+        self.__expire_connecting()
+        if self.__timers:
+            self.__expire_held()
+        if self.__forward_max and self.__upstreams >= self.__forward_max:
+            return
+        if self.__waiting and self.__backoff.ready(background = True):
+            for ip in list(self.__waiting):
+                self.__deliver(ip)
+        if len(self.__idle) < self.__forward_pool:
+            self.__fill_pool()
+
+    def __expire_connecting(self):
+        now = time.monotonic()
+        while self.__connecting and self.__connecting[0][0] <= now:
+            deadline, i, upstream = heapq.heappop(self.__connecting)
+            if upstream.connecting and upstream.sock.fileno() >= 0:
+                self.__log.logMsg('Forward to ' + str(upstream.addr) + ' timed out after ' + str(self.__forward_timeout) + 's', 2)
+                stats.upstream_failures += 1
+                self.__backoff.failure()
+                self.__drop_upstream(upstream)
+
+    def __update(self, conn):
+        # Register conn for the events its state requires
+        events = 0
+        if not conn.paused and not conn.connecting:
+            events |= selectors.EVENT_READ
+        if conn.connecting or conn.wbuf or conn.piped:
+            events |= selectors.EVENT_WRITE
+        if events == conn.events:
+            return
+        if conn.events == 0:
+            self.selector.register(conn.sock, events, conn)
+        elif events == 0:
+            self.selector.unregister(conn.sock)
         else:
-            time.sleep(0.4)
-            self.__log.logMsg('New connection list: ' + str(self.input_list), 5)
-
-    def on_close(self, in_s):
-        self.__log.logMsg('Entering on_close with ' + str(in_s), 5)
-        self.__log.logMsg('Connection list: ' + str(self.input_list), 5)
-        self.__log.logMsg('Channel dictionary: ' + str(self.channel), 5)
-        if in_s == self.input_list[0]:
-            # First connection  cannot be closed: proxy listening on its port
-            self.__log.logMsg('No connection left to close', 4)
+            self.selector.modify(conn.sock, events, conn)
+        conn.events = events
+
+    def __pause(self, conn, paused):
+        if conn.paused != paused:
+            self.__log.logMsg(lambda: ('Pausing ' if paused else 'Resuming ') + str(conn), 4)
+            conn.paused = paused
+            self.__update(conn)
+
+    def send(self, conn, data):
+        # Queue data for conn and write as much as the socket takes without blocking
+        if conn.connecting or conn.wbuf or conn.piped:
+            conn.wbuf += data
         else:
             try:
-                self.__log.logMsg('Trying to close ' + str(in_s), 5)
-                self.__log.logMsg(str(in_s.getpeername()) + " has disconnected", 3)
-                # close the connection with client
-                in_s.close()
+                n = conn.sock.send(data)
+            except BlockingIOError:
+                n = 0
+            if n < len(data):
+                conn.wbuf += memoryview(data)[n:]
+        if conn.wbuf:
+            self.__update(conn)
+            if len(conn.wbuf) + conn.piped > self.__high_water and conn.peer:
+                # stop reading what cannot be written
+                self.__pause(conn.peer, True)
+
+    def on_write(self, conn):
+        # Write queued data: spliced data in the pipe first, then the write buffer
+        try:
+            while conn.piped:
+                conn.piped -= os.splice(conn.pipe[0], conn.sock.fileno(), conn.piped, flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            while conn.wbuf:
+                n = conn.sock.send(conn.wbuf)
+                del conn.wbuf[:n]
+        except BlockingIOError:
+            pass
+        self.__update(conn)
+        if conn.peer and conn.peer.paused and len(conn.wbuf) + conn.piped <= self.__low_water:
+            self.__pause(conn.peer, False)
+
+    def splice(self, upstream):
+        # Move data from upstream to its client, returns False when upstream has closed
+        client = upstream.peer
+        if client.pipe == None:
+            client.pipe = os.pipe()
+        try:
+            n = os.splice(upstream.sock.fileno(), client.pipe[1], self.__buffer_size, flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+        except BlockingIOError:
+            # either no data or the pipe is full
+            if client.piped:
+                self.__pause(upstream, True)
+            return True
+        if n == 0:
+            return False
+        client.piped += n
+        stats.forward_bytes += n
+        if self.__log.enabled(4):
+            self.__log.logFmt('%d bytes spliced to: %s', n, client, vlevel = 4)
+        self.on_write(client)
+        if client.piped > self.__high_water or (client.piped and client.wbuf):
+            self.__pause(upstream, True)
+        return True
+
+    def __drop_upstream(self, upstream):
+        # Upstream failed, the client stays connected and is served locally
+        self.__close_socket(upstream)
+        upstream.connecting = False
+        if upstream.peer:
+            client = upstream.peer
+            client.peer = None
+            upstream.peer = None
+            self.__pause(client, False)
+
+    def __connect_upstream(self, background = False):
+        # New upstream connection without a client, None if not possible now.
+        # background: no bridge waits for it, see Backoff
+        if self.__forward_to[0] in (None, 'None') or self.__forward_to[1] == None:
+            return None
+        if self.__forward_max and self.__upstreams >= self.__forward_max:
+            stats.upstream_capped += 1
+            return None
+        if not self.__backoff.ready(background = background):
+            return None
+        forward = Forward(self.__log).start(self.__forward_to[0], self.__forward_to[1])
+        if not forward:
+            self.__backoff.failure()
+            return None
+        upstream = Connection(forward, self.__forward_to, False)
+        upstream.connecting = True
+        self.__open.add(upstream)
+        self.__upstreams += 1
+        self.__update(upstream)
+        heapq.heappush(self.__connecting, (time.monotonic() + self.__forward_timeout, id(upstream), upstream))
+        return upstream
+
+    def __fill_pool(self):
+        while len(self.__idle) < self.__forward_pool:
+            upstream = self.__connect_upstream(background = True)
+            if upstream == None:
+                return
+            self.__idle[upstream] = None
+
+    def __acquire_upstream(self, client):
+        # Upstream for a new client: the connection held for its ip, a pooled or a new one
+        upstream = self.__held.pop(client.addr[0], None)
+        if upstream != None:
+            del self.__held_ip[upstream]
+            stats.upstream_reused += 1
+            self.__log.logMsg(lambda: 'Reusing ' + str(upstream) + ' for ' + str(client), 4)
+        elif self.__idle:
+            upstream = next(iter(self.__idle))
+            del self.__idle[upstream]
+        else:
+            upstream = self.__connect_upstream()
+        if upstream != None:
+            upstream.peer = client
+            client.peer = upstream
+        if len(self.__idle) < self.__forward_pool:
+            self.__fill_pool()
+        return upstream
+
+    def __hold(self, ip, upstream):
+        # Keep upstream without a client for ip
+        if upstream.peer:
+            upstream.peer.peer = None
+            upstream.peer = None
+        self.__pause(upstream, False)
+        old = self.__held.get(ip)
+        if old != None:
+            self.__close_socket(old)
+        self.__held[ip] = upstream
+        deadline = time.monotonic() + self.__forward_reuse
+        self.__held_ip[upstream] = [ip, deadline]
+        heapq.heappush(self.__timers, (deadline, id(upstream), upstream))
+
+    def __expire_held(self):
+        now = time.monotonic()
+        while self.__timers and self.__timers[0][0] <= now:
+            deadline, i, upstream = heapq.heappop(self.__timers)
+            entry = self.__held_ip.get(upstream)
+            if entry == None:
+                continue
+            if entry[1] > now or upstream.wbuf or upstream.connecting:
+                # used again meanwhile or not everything delivered yet
+                heapq.heappush(self.__timers, (max(entry[1], now + 1), i, upstream))
+                continue
+            self.__log.logMsg(lambda: 'Closing unused ' + str(upstream) + ' of ' + entry[0], 4)
+            self.__close_socket(upstream)
+
+    def __deliver(self, ip):
+        # Store and forward: send the queued frames of ip to the portal
+        upstream = self.__held.get(ip)
+        if upstream == None:
+            upstream = self.__connect_upstream(background = True)
+            if upstream == None:
+                self.__waiting.add(ip)
+                return
+            self.__hold(ip, upstream)
+        self.__waiting.discard(ip)
+        if upstream.connecting:
+            # on_connect delivers
+            return
+        data = self.forward_queue.take(ip)
+        if data:
+            self.send(upstream, data)
+            stats.forward_bytes += len(data)
+            self.__log.logMsg(lambda: str(len(data)) + ' queued bytes of ' + ip + ' forwarded to: ' + str(upstream), 4)
+        self.__held_ip[upstream][1] = time.monotonic() + self.__forward_reuse
+
+    def upstream_counts(self):
+        return {'open': self.__upstreams, 'idle': len(self.__idle), 'held': len(self.__held)}
+
+    def on_connect(self, upstream):
+        err = upstream.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err != 0:
+            self.__log.logMsg('Forward produced error: ' + os.strerror(err), 2)
+            stats.upstream_failures += 1
+            self.__backoff.failure()
+            self.__drop_upstream(upstream)
+            return
+        self.__log.logMsg('Connected to remote server ' + str(upstream.addr), 3)
+        self.__backoff.success()
+        upstream.connecting = False
+        entry = self.__held_ip.get(upstream)
+        if entry != None and self.forward_queue != None:
+            self.__deliver(entry[0])
+        if upstream.wbuf:
+            self.__log.logMsg(lambda: 'Forwarding buffered data to: ' + str(upstream), 3)
+        try:
+            self.on_write(upstream)
+        except OSError as e:
+            self.__log.logFmt('Forward socket error: %s', e, vlevel = 3)
+            self.on_close(upstream)
+
+    def on_accept(self):
+        self.__log.logMsg('Entering on_accept', 5)
+        while True:
+            try:
+                clientsock, clientaddr = self.server.accept()
+            except BlockingIOError:
+                # all pending connections have been accepted
+                return
             except OSError as e:
-                self.__log.logMsg('On_close socket error with ' + str(in_s) + ': ' + str(e), 2, syslog.LOG_ERR)
-            self.input_list.remove(in_s)
-            if in_s in self.channel:
-                out_s = self.channel[in_s]
-                try:
-                    self.__log.logMsg('Trying to close ' + str(out_s), 5)
-                    self.__log.logMsg('Closing connection to remote server ' + str(out_s.getpeername()), 2)
-                    # close the connection with remote server
-                    out_s.close()
-                except OSError as e:
-                    self.__log.logMsg('On_close socket error with ' + str(out_s) + ': ' + str(e), 2, syslog.LOG_ERR)
-                #remove objects from input_list
-                self.input_list.remove(out_s)
-                self.__log.logMsg('Remaining connection list: ' + str(self.input_list), 5)
-                # delete both objects from channel dict
-                del self.channel[in_s]
-                del self.channel[out_s]
-            self.__log.logMsg('Remaining channel dictionary: ' + str(self.channel), 5)
-        
+                self.__log.logMsg('On_accept socket error: ' + str(e), 2)
+                return
+            clientsock.setblocking(False)
+            stats.accepted += 1
+            if stats.accepted == 1:
+                age = process_age()
+                if age != None:
+                    self.__log.logMsg('First connection accepted ' + '%.0f' % (age * 1000) + ' ms after start', 1)
+            self.__log.logMsg(lambda: str(clientaddr) + ' has connected', 3)
+            client = Connection(clientsock, clientaddr, True)
+            self.__open.add(client)
+            self.__update(client)
+            if self.forward_queue == None:
+                upstream = self.__acquire_upstream(client)
+                if upstream != None:
+                    self.__log.logMsg(lambda: 'New channel: ' + str(client) + ' <-> ' + str(upstream), 5)
+            self.__log.logMsg(lambda: 'Open connections: ' + str(len(self.__open)), 5)
+
+    def __close_socket(self, conn):
+        if conn in self.__open:
+            self.__open.remove(conn)
+            if not conn.client:
+                self.__upstreams -= 1
+                self.__idle.pop(conn, None)
+                entry = self.__held_ip.pop(conn, None)
+                if entry != None:
+                    del self.__held[entry[0]]
+                    if self.forward_queue != None:
+                        if conn.wbuf:
+                            # not delivered, try again with the next connection
+                            self.forward_queue.requeue(entry[0], conn.wbuf)
+                            conn.wbuf = bytearray()
+                        if entry[0] in self.forward_queue:
+                            self.__waiting.add(entry[0])
+        if conn.events:
+            self.selector.unregister(conn.sock)
+            conn.events = 0
+        if conn.pipe:
+            os.close(conn.pipe[0])
+            os.close(conn.pipe[1])
+            conn.pipe  = None
+            conn.piped = 0
+        try:
+            conn.sock.close()
+        except OSError as e:
+            self.__log.logMsg('On_close socket error with ' + str(conn) + ': ' + str(e), 2, syslog.LOG_ERR)
+
+    def on_close(self, conn):
+        self.__log.logMsg(lambda: 'Entering on_close with ' + str(conn), 5)
+        self.__log.logMsg(lambda: str(conn.addr) + " has disconnected", 3)
+        # close the connection with client
+        self.__close_socket(conn)
+        if conn.client and conn.peer and self.__forward_reuse and not conn.peer.connecting:
+            # the bridge will reconnect, its upstream is kept for it
+            self.__hold(conn.addr[0], conn.peer)
+            return
+        if conn.peer:
+            out = conn.peer
+            self.__log.logMsg(lambda: 'Closing connection to remote server ' + str(out.addr), 2)
+            # close the connection with remote server
+            self.__close_socket(out)
+            conn.peer = None
+            out.peer  = None
+            out.connecting = False
+        self.__log.logMsg(lambda: 'Remaining connections: ' + str(len(self.__open)), 5)
+
     def close_all(self):
         # Close all connections
         self.__log.logMsg('Entering close_all', 5)
-        self.mqtt.loop_stop()
-        if len(self.input_list) > 1:
-            # First connection cannot be closed: proxy listening on its port
-            ilist = self.input_list[1:]
-            self.__log.logMsg('Connections to close: ' + str(self.input_list), 4)
-            for con in ilist:
-                self.on_close(con)
-
-    def extract(self, data, wrind):
-        pos1 = 40 + (wrind*64)
-        # Extract information from bytearray
-        #               1        2                    4        4    5    5    6        6    7    7 
-        # 0      6      2        0                    0        8    2    6    0        8    2    6
-        # -------------------------------------------------------------------------------------------
-        # cmd    cmd    account                       wrid     ?    dc   pwr  totalkWh temp ac   F
-        # -------------------------------------------------------------------------------------------
-        # 6803d6 681004 yyyyyyyy 00000000000000000000 xxxxxxxx 2202 40d0 352b 001c5f39 1d66 3872 3204
-        #
-        d_wr_id         = data[pos1:pos1+8]
-        d_hex_dc        = data[pos1+12:pos1+12+4]
-        d_hex_power     = data[pos1+16:pos1+16+4]
-        d_hex_total     = data[pos1+20:pos1+20+8]
-        d_hex_temp      = data[pos1+28:pos1+28+4]
-        d_hex_ac        = data[pos1+32:pos1+32+4]
-        d_hex_freq      = data[pos1+36:pos1+36+4]
-        d_hex_remaining = data[pos1+40:pos1+40+24]
-        # Calculation
-        d_dez_dc    = int(d_hex_dc, 16)/512
-        d_dez_power = int(d_hex_power, 16)/64
-        d_dez_total = int(d_hex_total, 16)/8192
-        d_dez_temp  = ((int(d_hex_temp[0:2], 16)*256+int(d_hex_temp[2:4], 16))/ 128)-40
-        d_dez_ac    = int(d_hex_ac, 16)/64
-        d_dez_freq  = int(d_hex_freq[0:2], 16)+int(d_hex_freq[2:4], 16)/ 256
-        # Ignore if converter id is zero
-        if int(d_wr_id, base=16) != 0:
-            result = {'wrid' : d_wr_id, 'dc' : d_dez_dc, 'power' : d_dez_power, 'totalkwh' : d_dez_total, 'temp' : d_dez_temp, 'ac' : d_dez_ac, 'freq' : d_dez_freq, 'remaining' : d_hex_remaining}
-            return result
+        if self.pipeline != None:
+            self.pipeline.stop()
+        if self.mqtt:
+            self.mqtt.loop_stop()
+        if self.metrics:
+            self.metrics.close()
+        if self.api:
+            self.api.close()
+        if self.capture:
+            self.capture.close()
+        if self.store:
+            self.store.close()
+        conns = self.connections()
+        self.__log.logMsg('Connections to close: ' + str(len(conns)), 4)
+        for conn in conns:
+            if conn.sock.fileno() >= 0:
+                self.on_close(conn)
 
     def submit_data(self, wrdata):
         # Can be https as well. Also: if you use another port then 80 or 443 do not forget to add the port number.
         # user and password.
 
+        if self.store:
+            self.store.add(wrdata)
+        if self.analytics != None:
+            self.analytics.update(wrdata)
         total = self.total.data(wrdata)
-        if total:
-            self.mqtt.publish('enverbridge/total', json.dumps(total))
-
-        for wrdict in wrdata:
-            id = wrdict.pop('wrid')
-            wrdict.pop('remaining', None)
-            self.__log.logMsg('Submitting data for converter: ' + str(id) + ' to MQTT', 3)
-            self.mqtt.publish('enverbridge/' + id, json.dumps(wrdict))
+        if self.state != None:
+            self.state.update(wrdata, total)
+        self.publisher.frame(wrdata, total)
+        if self.analytics != None and self.analytics.due():
+            self.publisher.analytics(self.analytics.data())
         self.__log.logMsg('Finished sending to MQTT', 2)
 
     def process_data(self, data):
-        datainhex = data.hex()
-        wr = []
-        wr_index = 0
-        wr_index_max = ((len(datainhex)-40)//64)
+        self.submit_data(self.decode_data(data))
+
+    def decode_data(self, data):
+        # Only reads the server, Pipeline runs it in several threads at once
         self.__log.logMsg("Processing Data", 5)
-        while True:
-            response = self.extract(datainhex, wr_index)
-            if response:
+        start = time.perf_counter()
+        wr = decoder.decode(data)
+        stats.decode.observe(time.perf_counter() - start)
+        if self.__log.enabled(2):
+            for response in wr:
                 self.__log.logMsg('Decoded data from microconverter with ID ' + str(response['wrid']), 2)
-                wr.append(response)
-            wr_index += 1
-            if wr_index >= wr_index_max:
-                break
-        self.__log.logMsg('Finished processing data for ' + str(len(wr)) + ' microconverter: ' + str(wr), 4)
-        self.__log.logMsg('Processed data for ' + str(len(wr)) + ' microconverter', 3)
-        self.submit_data(wr)
-
-    def handshake(self, data):
-        data = bytearray(data)
-        # Microconverter starts with 680030681006
-        if data[:6].hex() == '680030681006':
-            # microconverter expects reply starting with 680030681007
-            data[5] = 7
-            return data
-        else:
-            self.__log.logMsg('Microconverter sent wrong start sequence ' + str(data[:6].hex()), 2)
+            self.__log.logFmt('Finished processing data for %d microconverter: %s', len(wr), wr, vlevel = 4)
+            self.__log.logFmt('Processed data for %d microconverter', len(wr), vlevel = 3)
+        return wr
 
-    def on_recv(self):
-        data = self.data
-        self.__log.logMsg(str(len(data)) + ' bytes in on_recv', 4)
-        self.__log.logMsg('Data received as hex: ' + str(data.hex()), 2)
-        if self.s.getsockname()[1] == self.__port:
+    def on_recv(self, conn, data):
+        if self.__log.enabled(2):
+            self.__log.logFmt('%d bytes in on_recv', len(data), vlevel = 4)
+            self.__log.logMsg('Data received as hex: ' + data.hex(), 2)
+        if conn.client:
             # receving data from a client
             self.__log.logMsg('Data is coming from a client', 5)
-            if data[:6].hex() == '680030681006':
-                # converter initiates connection
-                # create reply packet
-                reply = self.handshake(data)
-                # This part is simulating handshake with envertecportal.com
-                # disable if working as proxy between Enverbridge and envertecportal.com
-                self.__log.logMsg('Replying to handshake with data ' + str(reply.hex()), 4)
-                self.s.send(reply)
-                self.__log.logMsg('Reply sent to: ' + str(self.s), 3)
-                data = json.dumps({"ip":self.s.getpeername()[0], "last_seen":datetime.utcnow().isoformat()})
-                self.mqtt.publish('enverbridge/bridge', data)
-            elif data[:6].hex() in ['6803d6681004', '680056681004']:
-                # payload from converter
-                self.process_data(data)
-            else:
-                self.__log.logMsg('Client sent message with unknown content and length ' + str(len(data)), 2, syslog.LOG_ERR)
+            for frame in conn.framer.feed(data):
+                self.on_frame(conn, frame)
+                if self.forward_queue != None:
+                    self.forward_queue.put(conn.addr[0], frame)
+                    self.__deliver(conn.addr[0])
+            if len(conn.framer) and self.__log.enabled(4):
+                self.__log.logFmt('%d bytes waiting for the rest of the frame', len(conn.framer), vlevel = 4)
         # forward data to proxy peer
-        if self.s in self.channel:
-            self.channel[self.s].send(data)
-            self.__log.logMsg('Data forwarded to: ' + str(self.channel[self.s]), 3)
+        if conn.peer:
+            self.send(conn.peer, data)
+            stats.forward_bytes += len(data)
+            if self.__log.enabled(3):
+                self.__log.logFmt('Data forwarded to: %s', conn.peer, vlevel = 3)
+
+    def on_frame(self, conn, data):
+        # Handle one complete frame sent by a bridge
+        if self.capture:
+            self.capture.write(conn.addr, data)
+        handler = self.__frames.get(bytes(data[:6]))
+        if handler == None:
+            stats.frames_unknown += 1
+            self.__log.logMsg('Client sent message with unknown content and length ' + str(len(data)), 2, syslog.LOG_ERR)
+            return
+        handler(conn, data)
+
+    def on_handshake(self, conn, data):
+        # converter initiates connection
+        stats.frames_handshake += 1
+        # This part is simulating handshake with envertecportal.com
+        # disable if working as proxy between Enverbridge and envertecportal.com
+        # microconverter expects the same frame starting with 680030681007,
+        # one copy of the frame with the command overwritten
+        reply = bytearray(data)
+        reply[:6] = HANDSHAKE_REPLY
+        if self.__log.enabled(4):
+            self.__log.logMsg('Replying to handshake with data ' + reply.hex(), 4)
+        self.send(conn, reply)
+        if self.__log.enabled(3):
+            self.__log.logFmt('Reply sent to: %s', conn, vlevel = 3)
+        self.publisher.bridge(conn.addr[0])
+
+    def on_payload(self, conn, data):
+        # payload from converter
+        if data[1] == 0x03:
+            stats.frames_6803d6 += 1
+        else:
+            stats.frames_680056 += 1
+        if self.dedup != None and self.dedup.duplicate(conn.addr[0], data):
+            stats.frames_duplicate += 1
+            self.__log.logMsg(lambda: 'Skipping duplicate payload from ' + str(conn), 3)
+            return
+        if self.pipeline != None:
+            self.pipeline.put(conn.addr[0], data)
+        else:
+            self.process_data(data)
 
 
 class Signal_handler:
@@ -362,50 +966,164 @@ class Signal_handler:
         self.__log.logMsg('Received SIGTERM, closing connections', 2)
         self.__server.close_all()
         self.__log.logMsg('Stopping server', 1)
+        self.__log.stop()
         sys.exit(0)
 
+    def sighup_handler(self, signal, frame):
+        self.__log.logMsg('Received SIGHUP, reloading configuration', 2)
+        self.__server.request_reload()
+
 
 if __name__ == '__main__':
+    args = parse_args()
+    config = internal_config(args.config)
     # Initial verbositiy level is always 2
     # Start logging to std.out by default and until config is read 
     log = slog('Envertec Proxy', verbosity = 2, log_type='sys.stdout')
-    # Get configuration data
-    if os.path.isfile(config['internal']['conf_file']):
-       config.read(config['internal']['conf_file'])
-       section = config['internal']['section']
-       if section not in config:
-           log.logMsg('Section ' + section + ' is missing in config file ' + config['internal']['conf_file'], 2)
-           log.logMsg('Stopping server', 1)
-           sys.exit(1)
-       for k in ast.literal_eval(config['internal']['keys']):
-           if k not in config[section]:
-               log.logMsg('Config variable "' + k + '" is missing in config file ' + config['internal']['conf_file'], 2)
-               log.logMsg('Stopping server', 1)
-               sys.exit(1)
-    else:
-        log.logMsg('Configuration file ' + config['internal']['conf_file'] + ' not found', 2)
+    # Get configuration data, checked the same way as on reload
+    try:
+        config = read_config(config['internal'])
+    except (ValueError, configparser.Error) as e:
+        log.logMsg(str(e), 2)
         log.logMsg('Stopping server', 1)
         sys.exit(1)
     # Process configuration data
-    verbosity   = int(config['enverproxy']['verbosity'])
-    log_type    = config['enverproxy']['log_type']
-    log_address = config['enverproxy']['log_address']
-    log_port    = int(config['enverproxy']['log_port'])
-    log         = slog('Envertec Proxy', verbosity, log_type, log_address, log_port)
-    forward_to  = (config['enverproxy']['forward_IP'], int(config['enverproxy']['forward_port']))
-    delay       = float(config['enverproxy']['delay'])
-    buffer_size = int(config['enverproxy']['buffer_size'])
-    port        = int(config['enverproxy']['listen_port'])
-    server      = TheServer(host = '', port = port, forward_to = forward_to, delay = delay, buffer_size = buffer_size, log = log, config = config)
-    server.connect_mqtt(config['enverproxy']['mqtthost'], config['enverproxy']['mqttuser'], config['enverproxy']['mqttpassword'], int(config['enverproxy']['mqttport']))
-    # Catch SIGTERM signals    
-    signal.signal(signal.SIGTERM, Signal_handler(server, log).sigterm_handler)
-    # Start proxy server
-    log.logMsg('Starting server (v' + config['internal']['version'] + ')', 1)
-    try:
-        server.main_loop()
-    except KeyboardInterrupt:
-        log.logMsg('Ctrl-C received, closing connections', 2)
-        server.close_all()
-        log.logMsg('Stopping server', 1)
-        sys.exit(0)
+    def start_log():
+        return slog('Envertec Proxy', **log_settings(config))
+
+    def start_analytics(log):
+        interval = float(config['enverproxy'].get('analytics_interval', '0'))
+        if interval <= 0:
+            return None
+        return Analytics(log, interval, float(config['enverproxy'].get('analytics_ewma', '300')))
+
+    def run_server(worker = None, total = None):
+        log         = start_log()
+        forward_to  = (config['enverproxy']['forward_IP'], int(config['enverproxy']['forward_port']))
+        delay       = float(config['enverproxy']['delay'])
+        forward_timeout = float(config['enverproxy'].get('forward_timeout', '5'))
+        buffer_size = int(config['enverproxy']['buffer_size'])
+        port        = int(config['enverproxy']['listen_port'])
+        splice      = config['enverproxy'].get('forward_splice', 'False') == 'True'
+        high_water  = int(config['enverproxy'].get('forward_high_water', '65536'))
+        low_water   = int(config['enverproxy'].get('forward_low_water', '16384'))
+        forward = {'forward_pool':        int(config['enverproxy'].get('forward_pool', '0')),
+                   'forward_reuse':       float(config['enverproxy'].get('forward_reuse', '0')),
+                   'forward_max':         int(config['enverproxy'].get('forward_max', '0')),
+                   'forward_backoff':     float(config['enverproxy'].get('forward_backoff', '0')),
+                   'forward_backoff_max': float(config['enverproxy'].get('forward_backoff_max', '60'))}
+        if config['enverproxy'].get('forward_mode', 'direct') == 'queue':
+            forward['forward_queue'] = ForwardQueue(int(config['enverproxy'].get('forward_queue_size', '1048576')))
+        metrics_port    = int(config['enverproxy'].get('metrics_port', '0'))
+        metrics_address = config['enverproxy'].get('metrics_address', '127.0.0.1')
+        capture_file    = config['enverproxy'].get('capture_file', '')
+        capture     = None
+        if capture_file:
+            capture = Capture(capture_file if worker == None else capture_file + '.' + str(worker), log)
+        dedup_window = float(config['enverproxy'].get('dedup_window', '0'))
+        pipeline_threads = int(config['enverproxy'].get('pipeline_threads', '0'))
+        pipeline_queue   = int(config['enverproxy'].get('pipeline_queue', '1024'))
+        pipeline_policy  = config['enverproxy'].get('pipeline_policy', 'drop-oldest')
+        api_port    = int(config['enverproxy'].get('api_port', '0'))
+        api_address = config['enverproxy'].get('api_address', '127.0.0.1')
+        store_path  = config['enverproxy'].get('store_path', '')
+        store       = None
+        if store_path:
+            store = Store(store_path if worker == None else store_path + '.' + str(worker), log,
+                          flush_interval = float(config['enverproxy'].get('store_flush_interval', '10')),
+                          retention = json.loads(config['enverproxy'].get('store_retention', '{}') or '{}'))
+        server      = TheServer(host = '', port = port, forward_to = forward_to, delay = delay, buffer_size = buffer_size, log = log, config = config, forward_timeout = forward_timeout, reuse_port = worker != None,
+                                splice = splice, high_water = high_water, low_water = low_water,
+                                metrics_port = metrics_port + (worker or 0) if metrics_port else None, metrics_address = metrics_address, capture = capture,
+                                store = store, api_port = api_port + (worker or 0) if api_port else None, api_address = api_address,
+                                dedup_window = dedup_window, pipeline_threads = pipeline_threads, pipeline_queue = pipeline_queue,
+                                pipeline_policy = pipeline_policy, analytics = start_analytics(log) if worker == None else None, **forward)
+        if total:
+            # fleet totals are calculated by the aggregator
+            server.total = total
+        client_id   = 'enverproxy' if worker == None else 'enverproxy-' + str(worker)
+        server.connect_mqtt(*mqtt_settings(config), client_id = client_id)
+        # Catch SIGTERM signals    
+        handler = Signal_handler(server, log)
+        signal.signal(signal.SIGTERM, handler.sigterm_handler)
+        # Reload the configuration on SIGHUP
+        signal.signal(signal.SIGHUP, handler.sighup_handler)
+        # Start proxy server
+        if worker == None:
+            log.logMsg('Starting server (v' + config['internal']['version'] + ')', 1)
+        else:
+            log.logMsg('Starting worker ' + str(worker) + ' (v' + config['internal']['version'] + ')', 1)
+        try:
+            server.main_loop()
+        except KeyboardInterrupt:
+            log.logMsg('Ctrl-C received, closing connections', 2)
+            server.close_all()
+            log.logMsg('Stopping server', 1)
+            log.stop()
+            sys.exit(0)
+
+    def run_replay():
+        log    = start_log()
+        server = TheServer(host = '127.0.0.1', port = 0, forward_to = (None, None), log = log, config = config)
+        if args.dry_run:
+            server.mqtt = server.publisher.mqtt = DiscardClient()
+        else:
+            server.connect_mqtt(*mqtt_settings(config), client_id = 'enverproxy-replay')
+        # replay timing starts when MQTT is ready, messages before are queued anyway
+        deadline = time.monotonic() + 10
+        while not server.publisher.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        Replay(server, args.replay, log).run(args.replay_speed)
+        if server.mqtt:
+            server.mqtt.loop_stop()
+        log.stop()
+
+    if args.replay:
+        run_replay()
+    elif args.workers <= 1:
+        run_server()
+    else:
+        log = start_log()
+        aggregator = Aggregator(args.workers, run_server, log)
+        signal.signal(signal.SIGTERM, aggregator.sigterm_handler)
+        aggregator.start()
+        signal.signal(signal.SIGHUP, aggregator.sighup_handler)
+        signal.signal(signal.SIGCHLD, aggregator.sigchld_handler)
+        # fleet totals of all workers, published by this process
+        total     = Total(log, config)
+        publisher = Publisher(log, config)
+        publisher.attach(connect_mqtt(*mqtt_settings(config), client_id = 'enverproxy'))
+        publisher.mqtt.loop_start()
+        analytics = start_analytics(log)
+
+        def reload():
+            # workers restarted later on are forked with the new configuration
+            global config
+            start = time.perf_counter()
+            try:
+                new = read_config(config['internal'])
+            except (ValueError, configparser.Error) as e:
+                log.logMsg('Reload failed, keeping the current configuration: ' + str(e), 1)
+                return
+            log.configure(**log_settings(new))
+            total.configure(new)
+            publisher.configure(new)
+            if analytics != None:
+                analytics.configure(new)
+            if mqtt_settings(new) != mqtt_settings(config):
+                try:
+                    reconnect_mqtt(publisher, mqtt_settings(new), 'enverproxy')
+                except OSError as e:
+                    log.logMsg('Connecting to the new MQTT broker failed, keeping the current one: ' + str(e), 1)
+            config = new
+            log.logMsg('Reloaded configuration in ' + '%.1f' % ((time.perf_counter() - start) * 1000) + ' ms', 1)
+        aggregator.on_reload = reload
+        log.logMsg('Starting server with ' + str(args.workers) + ' workers (v' + config['internal']['version'] + ')', 1)
+        try:
+            aggregator.main_loop(total, publisher, analytics)
+        except KeyboardInterrupt:
+            log.logMsg('Ctrl-C received, stopping workers', 2)
+            aggregator.stop()
+            log.logMsg('Stopping server', 1)
+            log.stop()
+            sys.exit(0)
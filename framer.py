@@ -0,0 +1,78 @@
+# First six bytes of the frames a bridge sends: header and command
+HANDSHAKE       = b'\x68\x00\x30\x68\x10\x06'
+HANDSHAKE_REPLY = b'\x68\x00\x30\x68\x10\x07'
+PAYLOAD         = b'\x68\x03\xd6\x68\x10\x04'
+PAYLOAD_SHORT   = b'\x68\x00\x56\x68\x10\x04'
+
+
+class Framer:
+
+    # Reassembles Envertec frames from a TCP stream
+    #
+    #   68 LL LL 68 <payload> CS 16
+    #
+    # LL LL is the length of the whole frame including header and trailer,
+    # e.g. 680030 (48 bytes, handshake) or 6803d6 (982 bytes, payload).
+    # Bytes that cannot be the start of a frame are returned as they are,
+    # so the caller can report them as unknown content.
+
+    HEADER = 4
+    START  = 0x68
+    END    = 0x16
+
+    def __init__(self, max_length = 4096):
+        self.__max_length = max_length
+        # bytes of an incomplete frame, kept until the rest arrives
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def feed(self, data):
+        # Returns the list of frames completed by data
+        buf = self.buffer
+        if buf:
+            buf += data
+            src = buf
+        else:
+            # nothing buffered: slice frames directly from the received data
+            src = data
+        frames = []
+        pos = 0
+        end = len(src)
+        with memoryview(src) as mv:
+            while end - pos >= self.HEADER:
+                length = (src[pos+1] << 8) | src[pos+2]
+                if src[pos] != self.START or src[pos+3] != self.START or length < self.HEADER + 2 or length > self.__max_length:
+                    # not a frame header, skip to the next possible start
+                    nxt = src.find(self.START, pos + 1)
+                    if nxt < 0:
+                        nxt = end
+                    frames.append(bytes(mv[pos:nxt]))
+                    pos = nxt
+                    continue
+                if end - pos < length:
+                    # incomplete frame, wait for more data
+                    break
+                if src[pos+length-1] != self.END:
+                    # length does not match, resynchronize on the next start byte
+                    nxt = src.find(self.START, pos + 1)
+                    if nxt < 0:
+                        nxt = end
+                    frames.append(bytes(mv[pos:nxt]))
+                    pos = nxt
+                    continue
+                if pos == 0 and length == end and src is data and type(data) is bytes:
+                    # the common case: one recv holds exactly one frame
+                    frames.append(data)
+                else:
+                    frames.append(bytes(mv[pos:pos+length]))
+                pos += length
+        if src is buf:
+            del buf[:pos]
+        elif pos < end:
+            buf += data[pos:]
+        return frames
+
+    def reset(self):
+        self.buffer.clear()
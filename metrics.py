@@ -0,0 +1,267 @@
+import bisect
+import selectors
+import socket
+import threading
+from slog import slog
+
+
+class Histogram:
+    # Fixed buckets, observe() only increments existing counters
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum    = 0.0
+        self.count  = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+    def render(self, name, text):
+        text.append('# TYPE ' + name + ' histogram')
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            text.append(name + '_bucket{le="' + repr(bound) + '"} ' + str(cumulative))
+        text.append(name + '_bucket{le="+Inf"} ' + str(self.count))
+        text.append(name + '_sum ' + repr(self.sum))
+        text.append(name + '_count ' + str(self.count))
+
+
+class ThreadHistogram:
+    # Histogram observed by several threads (event loop, pipeline, MQTT). Every
+    # thread counts into a Histogram of its own, so no increment is lost and the
+    # hot path takes no lock. render() adds them up.
+
+    def __init__(self, bounds):
+        self.bounds  = bounds
+        self.__local = threading.local()
+        self.__parts = []
+        self.__lock  = threading.Lock()
+
+    def observe(self, value):
+        try:
+            h = self.__local.histogram
+        except AttributeError:
+            h = self.__local.histogram = Histogram(self.bounds)
+            with self.__lock:
+                self.__parts.append(h)
+        h.observe(value)
+
+    def merged(self):
+        total = Histogram(self.bounds)
+        with self.__lock:
+            parts = list(self.__parts)
+        for h in parts:
+            for i, count in enumerate(h.counts):
+                total.counts[i] += count
+            total.sum += h.sum
+        # from the buckets, a thread may have observed meanwhile
+        total.count = sum(total.counts)
+        return total
+
+    def render(self, name, text):
+        self.merged().render(name, text)
+
+
+# seconds, from 10us to 1s
+LATENCY = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0)
+# seconds, from 100us to 30s
+LAG     = (0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+class Stats:
+    # Counters of the proxy hot paths. They are only updated by the event loop,
+    # so plain attribute increments need neither locks nor allocations. The
+    # histograms are also observed by pipeline and MQTT threads and keep one
+    # Histogram per thread. Counters outside of Stats that several threads
+    # increment, like Publisher.published, may rarely lose an increment.
+
+    def __init__(self):
+        self.accepted          = 0
+        self.recv_bytes        = 0
+        self.frames_handshake  = 0
+        self.frames_6803d6     = 0
+        self.frames_680056     = 0
+        self.frames_unknown    = 0
+        self.frames_duplicate  = 0
+        self.forward_bytes     = 0
+        self.upstream_failures = 0
+        self.upstream_reused   = 0
+        self.upstream_capped   = 0
+        # converter reports a worker could not pass on to the aggregator
+        self.reports_dropped   = 0
+        self.decode            = ThreadHistogram(LATENCY)
+        self.publish           = ThreadHistogram(LATENCY)
+        self.pipeline_lag      = ThreadHistogram(LAG)
+
+
+stats = Stats()
+
+
+def render(server):
+    # Prometheus text format of stats, the connections of server and its publisher and total
+    clients   = 0
+    upstreams = 0
+    for conn in server.connections():
+        if conn.client:
+            clients += 1
+        else:
+            upstreams += 1
+    text = []
+
+    def metric(name, kind, value, labels = ''):
+        if kind:
+            text.append('# TYPE enverproxy_' + name + ' ' + kind)
+        text.append('enverproxy_' + name + labels + ' ' + repr(value))
+
+    metric('connections', 'gauge', clients, '{kind="client"}')
+    metric('connections', None, upstreams, '{kind="upstream"}')
+    metric('accepted_total', 'counter', stats.accepted)
+    metric('recv_bytes_total', 'counter', stats.recv_bytes)
+    metric('frames_total', 'counter', stats.frames_handshake, '{type="680030"}')
+    metric('frames_total', None, stats.frames_6803d6, '{type="6803d6"}')
+    metric('frames_total', None, stats.frames_680056, '{type="680056"}')
+    metric('frames_total', None, stats.frames_unknown, '{type="unknown"}')
+    metric('frames_duplicate_total', 'counter', stats.frames_duplicate)
+    metric('forward_bytes_total', 'counter', stats.forward_bytes)
+    metric('upstream_connect_failures_total', 'counter', stats.upstream_failures)
+    metric('upstream_reused_total', 'counter', stats.upstream_reused)
+    metric('upstream_capped_total', 'counter', stats.upstream_capped)
+    metric('aggregator_reports_dropped_total', 'counter', stats.reports_dropped)
+    counts = server.upstream_counts()
+    metric('upstream_connections', 'gauge', counts['idle'], '{state="idle"}')
+    metric('upstream_connections', None, counts['held'], '{state="held"}')
+    queue = server.forward_queue
+    if queue != None:
+        metric('forward_queue_bytes', 'gauge', queue.bytes)
+        metric('forward_queue_dropped_total', 'counter', queue.dropped)
+        metric('forward_queue_delivered_bytes_total', 'counter', queue.delivered)
+    stats.decode.render('enverproxy_decode_seconds', text)
+    stats.publish.render('enverproxy_mqtt_publish_seconds', text)
+    publisher = server.publisher
+    metric('mqtt_published_total', 'counter', publisher.published)
+    metric('mqtt_suppressed_total', 'counter', publisher.suppressed)
+    metric('mqtt_queue_depth', 'gauge', publisher.queued())
+    pipeline = server.pipeline
+    if pipeline != None:
+        metric('pipeline_queue_depth', 'gauge', len(pipeline))
+        metric('pipeline_dropped_total', 'counter', pipeline.dropped)
+        stats.pipeline_lag.render('enverproxy_pipeline_lag_seconds', text)
+    state = server.state
+    if state != None:
+        metric('api_cache_hits_total', 'counter', state.hits)
+        metric('api_cache_misses_total', 'counter', state.misses)
+    total = server.total
+    if getattr(total, 'calculate', False):
+        metric('total_converters', 'gauge', len(total.devices))
+        metric('total_power_watts', 'gauge', total.power)
+        if total.total_phase_map:
+            for phase, power in total.phases.items():
+                metric('total_phase_power_watts', None if phase != 'L1' else 'gauge', power, '{phase="' + phase + '"}')
+    return '\n'.join(text) + '\n'
+
+
+def response(status, content_type, body):
+    return ('HTTP/1.0 ' + status + '\r\nContent-Type: ' + content_type + '\r\nContent-Length: ' + str(len(body)) + '\r\n\r\n').encode() + body
+
+
+NOT_FOUND = response('404 Not Found', 'text/plain', b'not found\n')
+
+
+class HttpServer:
+
+    # Minimal HTTP/1.0 GET endpoint, served by the event loop of server.
+    # Subclasses implement respond(path) returning the complete response.
+
+    def __init__(self, server, host, port, l = None):
+        if l == None:
+            self.__log = slog(self.__class__.__name__ + ' class')
+        else:
+            self.__log = l
+        self.__selector = server.selector
+        self.__requests = {}
+        self.__out      = {}
+        self.listener   = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(16)
+        self.listener.setblocking(False)
+
+    def start(self):
+        self.__selector.register(self.listener, selectors.EVENT_READ, self)
+
+    def on_event(self, sock, mask):
+        if sock is self.listener:
+            try:
+                conn, addr = self.listener.accept()
+            except OSError:
+                return
+            conn.setblocking(False)
+            self.__requests[conn] = b''
+            self.__selector.register(conn, selectors.EVENT_READ, self)
+            return
+        try:
+            if mask & selectors.EVENT_WRITE:
+                self.__write(sock)
+                return
+            data = sock.recv(4096)
+            if not data:
+                self.__close(sock)
+                return
+            request = self.__requests[sock] + data
+            self.__requests[sock] = request
+            if b'\r\n\r\n' not in request:
+                return
+            line = request.split(b'\r\n', 1)[0].split()
+            if len(line) >= 2 and line[0] == b'GET':
+                self.__out[sock] = self.respond(line[1].decode('latin-1'))
+            else:
+                self.__out[sock] = NOT_FOUND
+            self.__selector.modify(sock, selectors.EVENT_WRITE, self)
+            self.__write(sock)
+        except OSError as e:
+            self.__log.logFmt('HTTP socket error: %s', e, vlevel = 3)
+            self.__close(sock)
+
+    def __write(self, sock):
+        out = self.__out[sock]
+        try:
+            n = sock.send(out)
+        except BlockingIOError:
+            return
+        if n < len(out):
+            self.__out[sock] = out[n:]
+        else:
+            self.__close(sock)
+
+    def __close(self, sock):
+        self.__requests.pop(sock, None)
+        self.__out.pop(sock, None)
+        try:
+            self.__selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        sock.close()
+
+    def close(self):
+        for sock in list(self.__requests):
+            self.__close(sock)
+        self.__close(self.listener)
+
+
+class MetricsServer(HttpServer):
+
+    # Prometheus metrics of server
+
+    def __init__(self, server, host, port, l = None):
+        super().__init__(server, host, port, l)
+        self.__server = server
+
+    def respond(self, path):
+        if path == '/metrics' or path == '/':
+            return response('200 OK', 'text/plain; version=0.0.4; charset=utf-8', render(self.__server).encode())
+        return NOT_FOUND
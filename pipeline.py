@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+from metrics import stats
+from slog import slog
+
+POLICIES = ('drop-oldest', 'coalesce')
+
+
+class Pipeline:
+
+    # Decodes and publishes payloads outside of the event loop. The event loop
+    # only puts frames into a bounded queue, threads take them out, decode them
+    # in parallel and hand the results to submit_data of server one at a time,
+    # in the order the frames were queued. Frames are shed by policy:
+    #
+    #   drop-oldest  a full queue drops its oldest frame
+    #   coalesce     a new frame replaces the queued frame of the same bridge and
+    #                converters, a full queue drops its oldest frame if there is none
+
+    def __init__(self, server, threads = 1, size = 1024, policy = 'drop-oldest', l = None):
+        if l == None:
+            self.__log = slog('Pipeline class')
+        else:
+            self.__log = l
+        if policy not in POLICIES:
+            raise ValueError('Unknown pipeline policy ' + str(policy))
+        self.__server   = server
+        self.__threads  = []
+        self.__count    = threads
+        self.size       = size
+        self.policy     = policy
+        # sequence number -> (key, enqueue time, frame)
+        self.__queue    = OrderedDict()
+        # coalesce: key -> sequence number of its queued frame
+        self.__latest   = {}
+        self.__seq      = 0
+        self.__cond     = threading.Condition()
+        self.__stopping = False
+        self.dropped    = 0
+        # aggregation and publishing are not thread safe, one frame at a time
+        self.lock       = threading.Lock()
+        # frames are numbered when taken from the queue and submitted in that order
+        self.__turn     = threading.Condition(self.lock)
+        self.__taken    = 0
+        self.__submitted = 0
+
+    def __len__(self):
+        return len(self.__queue)
+
+    def start(self):
+        for i in range(self.__count):
+            t = threading.Thread(target = self.__run, name = 'pipeline-' + str(i), daemon = True)
+            t.start()
+            self.__threads.append(t)
+
+    def put(self, bridge, data):
+        # Called by the event loop, never blocks
+        key = (bridge, bytes(data[20:24]))
+        coalesce = self.policy == 'coalesce'
+        with self.__cond:
+            queue = self.__queue
+            if coalesce:
+                seq = self.__latest.get(key)
+                if seq != None:
+                    # the queued frame is outdated, the new one takes its place in the queue
+                    queue[seq] = (key, queue[seq][1], data)
+                    self.dropped += 1
+                    return
+            if len(queue) >= self.size:
+                seq, (old, t, frame) = queue.popitem(last = False)
+                if coalesce:
+                    del self.__latest[old]
+                self.dropped += 1
+            self.__seq += 1
+            queue[self.__seq] = (key, time.monotonic(), data)
+            if coalesce:
+                self.__latest[key] = self.__seq
+            self.__cond.notify()
+
+    def __run(self):
+        queue = self.__queue
+        while True:
+            with self.__cond:
+                while not queue and not self.__stopping:
+                    self.__cond.wait()
+                if not queue:
+                    return
+                seq, (key, t, data) = queue.popitem(last = False)
+                if self.__latest.get(key) == seq:
+                    del self.__latest[key]
+                turn = self.__taken
+                self.__taken += 1
+            stats.pipeline_lag.observe(time.monotonic() - t)
+            try:
+                wrdata = self.__server.decode_data(data)
+            except Exception as e:
+                self.__log.logMsg('Decoding payload failed: ' + repr(e), 1)
+                wrdata = None
+            with self.__turn:
+                while self.__submitted != turn:
+                    self.__turn.wait()
+                try:
+                    if wrdata != None:
+                        self.__server.submit_data(wrdata)
+                except Exception as e:
+                    self.__log.logMsg('Processing payload failed: ' + repr(e), 1)
+                self.__submitted += 1
+                self.__turn.notify_all()
+
+    def stop(self, timeout = 5.0):
+        # Processes the frames still queued, then ends the threads
+        with self.__cond:
+            self.__stopping = True
+            self.__cond.notify_all()
+        for t in self.__threads:
+            t.join(timeout)
+        self.__threads = []
@@ -0,0 +1,189 @@
+import json
+import time
+from collections import deque
+from datetime import datetime
+from metrics import stats
+from slog import slog
+
+
+class Publisher:
+
+    # Publishes decoded frames to MQTT and suppresses messages that carry no news
+    #
+    #   mqtt_change_only  only publish a converter if a value moved by more than its deadband
+    #   mqtt_deadband     deadband for all values, or a JSON object per value, e.g. {"power": 1.0}
+    #   mqtt_min_interval minimum number of seconds between two publishes of the same converter
+    #   mqtt_batch        publish all converters of a frame as one message to enverbridge/batch
+    #   mqtt_retain       publish with the MQTT retain flag
+    #   mqtt_bridge_interval minimum number of seconds between two bridge status messages of the same bridge
+
+    def __init__(self, l = None, config = None):
+        if l == None:
+            self.__log = slog('Publisher class')
+        else:
+            self.__log = l
+        self.mqtt         = None
+        self.published    = 0
+        # messages handed over to the network by the MQTT client
+        self.acked        = 0
+        self.suppressed   = 0
+        # messages sent while the client is not connected, published once it is
+        self.connected    = True
+        self.__pending    = deque(maxlen = 10000)
+        self.change_only  = False
+        self.deadband     = {}
+        self.default_band = 0.0
+        self.min_interval = 0.0
+        self.batch        = False
+        self.retain       = False
+        self.bridge_interval = 0.0
+        # bridge ip -> time of the last status message
+        self.__bridges    = {}
+        # topic -> (time of last publish, last published values)
+        self.__last       = {}
+        if config:
+            self.configure(config)
+
+    def configure(self, config):
+        c = config['enverproxy']
+        self.change_only  = c.get('mqtt_change_only', 'False') == 'True'
+        self.min_interval = float(c.get('mqtt_min_interval', '0'))
+        self.batch        = c.get('mqtt_batch', 'False') == 'True'
+        self.retain       = c.get('mqtt_retain', 'False') == 'True'
+        self.bridge_interval = float(c.get('mqtt_bridge_interval', '0'))
+        band = c.get('mqtt_deadband', '0')
+        try:
+            band = json.loads(band)
+        except Exception as e:
+            self.__log.logMsg("Failed to parse 'mqtt_deadband': " + str(e) + " continuing without deadband", 1)
+            band = 0
+        if isinstance(band, dict):
+            self.deadband     = {k: float(v) for k, v in band.items()}
+            self.default_band = 0.0
+        else:
+            self.deadband     = {}
+            self.default_band = float(band)
+
+    def attach(self, client):
+        # Publish with client. It is not connected yet, messages are queued until it is.
+        self.connected   = False
+        client.on_connect    = self.on_connect
+        client.on_disconnect = self.on_disconnect
+        client.on_publish    = self.on_publish
+        self.mqtt        = client
+
+    def send(self, topic, payload):
+        # Publish without any filtering
+        if not self.connected:
+            self.__pending.append((topic, payload))
+            return
+        if self.__pending:
+            self.flush()
+        self.__publish(topic, payload)
+
+    def __publish(self, topic, payload):
+        start = time.perf_counter()
+        self.mqtt.publish(topic, payload, retain = self.retain)
+        stats.publish.observe(time.perf_counter() - start)
+        self.published += 1
+
+    def flush(self):
+        # Publish the messages queued while not connected
+        while self.connected:
+            try:
+                topic, payload = self.__pending.popleft()
+            except IndexError:
+                return
+            self.__publish(topic, payload)
+
+    def bridge(self, ip, now = None, seen = None):
+        # Publish that the bridge at ip has connected. Bridges reconnect every second,
+        # so only the first connect per bridge_interval is published.
+        if now == None:
+            now = time.monotonic()
+        last = self.__bridges.get(ip)
+        if last != None and now - last < self.bridge_interval:
+            self.suppressed += 1
+            return
+        self.__bridges[ip] = now
+        if seen == None:
+            seen = datetime.utcnow()
+        self.send('enverbridge/bridge', json.dumps({"ip":ip, "last_seen":seen.isoformat()}))
+
+    def on_connect(self, client, userdata, flags, rc):
+        # paho callback, runs in the MQTT network thread
+        if client is not self.mqtt:
+            return
+        if rc != 0:
+            self.__log.logMsg('Connecting to MQTT broker failed with code ' + str(rc), 2)
+            return
+        self.__log.logMsg(lambda: 'Connected to MQTT broker, ' + str(len(self.__pending)) + ' queued messages', 2)
+        self.connected = True
+        self.flush()
+
+    def on_disconnect(self, client, userdata, rc):
+        if client is self.mqtt:
+            self.__log.logMsg('Disconnected from MQTT broker with code ' + str(rc), 2)
+            self.connected = False
+
+    def on_publish(self, client, userdata, mid):
+        # paho callback, runs in the MQTT network thread
+        self.acked += 1
+
+    def queued(self):
+        # Messages published but not yet sent by the MQTT client, or waiting for the connection
+        return self.published - self.acked + len(self.__pending)
+
+    def changed(self, topic, values, now):
+        # True if values should be published to topic, remembers them if so
+        last = self.__last.get(topic)
+        if last:
+            if now - last[0] < self.min_interval:
+                return False
+            if self.change_only:
+                old = last[1]
+                for k, v in values.items():
+                    o = old.get(k)
+                    if o == None or abs(v - o) > self.deadband.get(k, self.default_band):
+                        break
+                else:
+                    return False
+        self.__last[topic] = (now, values)
+        return True
+
+    def analytics(self, data):
+        # Publish the derived values of Analytics, batched like the converter data
+        if self.batch:
+            self.send('enverbridge/analytics', json.dumps(data))
+            return
+        for id, values in data.items():
+            self.send('enverbridge/' + id + '/analytics', json.dumps(values))
+
+    def frame(self, wrdata, total = None):
+        # Publish the converters of one bridge frame and the fleet total
+        now = time.monotonic()
+        if total:
+            if not self.change_only or self.__last.get('enverbridge/total', (0, None))[1] != total:
+                self.__last['enverbridge/total'] = (now, total)
+                self.send('enverbridge/total', json.dumps(total))
+            else:
+                self.suppressed += 1
+
+        batch = {}
+        for wrdict in wrdata:
+            id = wrdict.pop('wrid')
+            wrdict.pop('remaining', None)
+            topic = 'enverbridge/' + id
+            if not self.changed(topic, wrdict, now):
+                self.__log.logMsg(lambda: 'Suppressed unchanged data for converter: ' + str(id), 4)
+                self.suppressed += 1
+                continue
+            if self.batch:
+                batch[id] = wrdict
+            else:
+                self.__log.logMsg(lambda: 'Submitting data for converter: ' + str(id) + ' to MQTT', 3)
+                self.send(topic, json.dumps(wrdict))
+        if batch:
+            self.__log.logMsg(lambda: 'Submitting data for ' + str(len(batch)) + ' converters to MQTT', 3)
+            self.send('enverbridge/batch', json.dumps(batch))
+        self.__log.logMsg(lambda: 'MQTT messages published: ' + str(self.published) + ' suppressed: ' + str(self.suppressed), 3)
@@ -1,6 +1,7 @@
 import sys
 import logging
 import logging.handlers
+import queue
 
 class slog:
     
@@ -10,10 +11,19 @@ class slog:
     #   3 = + flow control
     #   4 = + data 
     #   5 = anything
+
+    # QueueListener per logger ident, writing records in a background thread
+    __listeners = {}
     
-    def __init__(self, ident='', verbosity = 3, log_type='syslog', log_address='/dev/log', log_port=514, cat = logging.INFO):
+    def __init__(self, ident='', verbosity = 3, log_type='syslog', log_address='/dev/log', log_port=514, cat = logging.INFO, log_queue = False):
         self.__ident    = ident
         self.__cat      = cat
+        self.__logger   = logging.getLogger(self.__ident)
+        self.__logger.setLevel(self.__cat)
+        self.configure(verbosity, log_type, log_address, log_port, log_queue)
+
+    def configure(self, verbosity = 3, log_type='syslog', log_address='/dev/log', log_port=514, log_queue = False):
+        # (Re)create the handler. Everybody sharing this instance logs through the new handler at once.
         self.set_verbosity(verbosity)
         self.__type     = log_type
         self.__address  = log_address
@@ -38,23 +48,59 @@ class slog:
                 ch = logging.handlers.SysLogHandler(address=(log_address, log_port), facility='daemon')
             formatter = logging.Formatter('%(name)s: %(message)s')
             ch.setFormatter(formatter)
+
+        old = self.__listeners.pop(self.__ident, None)
+        if log_queue:
+            # the caller only enqueues records, the handler runs in the listener thread
+            q = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(q, ch)
+            listener.start()
+            self.__listeners[self.__ident] = listener
+            ch = logging.handlers.QueueHandler(q)
            
-        self.__logger = logging.getLogger(self.__ident)
-        self.__logger.setLevel(self.__cat)   
-        if self.__logger.handlers:
-            # remove previous handler
-            self.__logger.handlers.pop()
-        self.__logger.addHandler(ch)
+        # replace the previous handler in one step
+        previous = self.__logger.handlers
+        self.__logger.handlers = [ch]
+        if old:
+            # flush and stop the writer thread of a previous instance
+            old.stop()
+            previous += old.handlers
+        for h in previous:
+            h.close()
 
     def __repr__(self):
-        return 'log(' + str(self.__ident) + ',' + self.__verbosity + ',' + self.__type + ',' + self.__address + ',' + self.__port + ')'
+        return 'log(' + str(self.__ident) + ',' + str(self.__verbosity) + ',' + self.__type + ',' + self.__address + ',' + str(self.__port) + ')'
     
+    def enabled(self, vlevel = 3):
+        # Cheap guard for callers that have to do work before logging
+        return vlevel <= self.__verbosity
+
     def logMsg (self, msg, vlevel = 3, cat = None):
+        # msg may be a callable returning the message, it is only called
+        # if the message is written
+        if vlevel > self.__verbosity:
+            return
         if cat == None:
             cat = self.__cat
+        if callable(msg):
+            msg = msg()
         # Only write to log if vlevel <= verbosity
-        if vlevel <= self.__verbosity:
-            self.__logger.log(cat, msg)
+        self.__logger.log(cat, msg)
+
+    def logFmt (self, msg, *args, vlevel = 3, cat = None):
+        # Like logMsg, args are merged into msg with %-formatting only if the
+        # message is written, e.g. logFmt('%d bytes from %s', n, addr, vlevel = 4)
+        if vlevel > self.__verbosity:
+            return
+        if cat == None:
+            cat = self.__cat
+        self.__logger.log(cat, msg, *args)
+
+    def stop(self):
+        # Write out queued messages
+        listener = self.__listeners.pop(self.__ident, None)
+        if listener:
+            listener.stop()
             
     def set_verbosity(self, verbosity):
         if verbosity < 1:
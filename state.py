@@ -0,0 +1,100 @@
+import copy
+import json
+import threading
+import time
+from metrics import HttpServer, NOT_FOUND, response
+
+FIELDS = ('power', 'dc', 'ac', 'temp', 'freq', 'totalkwh')
+
+
+class Reading:
+    # Latest values of one converter, time is when they last changed
+    __slots__ = ('time',) + FIELDS
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    def update(self, wrdict, now):
+        changed = False
+        for name in FIELDS:
+            value = wrdict[name]
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                changed = True
+        if changed:
+            self.time = now
+        return changed
+
+    def dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class State:
+
+    # Latest reading of every converter and the latest fleet total.
+    # Serialized responses are cached until the data behind them changes.
+    # update() may run in a pipeline thread while the event loop serves responses.
+
+    def __init__(self):
+        self.converters = {}
+        self.total      = None
+        self.__cache    = {}
+        self.hits       = 0
+        self.misses     = 0
+        self.__lock     = threading.Lock()
+
+    def update(self, wrdata, total = None, now = None):
+        if now == None:
+            now = time.time()
+        with self.__lock:
+            self.__update(wrdata, total, now)
+
+    def __update(self, wrdata, total, now):
+        cache = self.__cache
+        for wrdict in wrdata:
+            id = wrdict['wrid']
+            reading = self.converters.get(id)
+            if reading == None:
+                reading = self.converters[id] = Reading()
+            if reading.update(wrdict, now):
+                cache.pop('/api/converters/' + id, None)
+                cache.pop('/api/converters', None)
+        if total and total != self.total:
+            # Total.data returns a new dict per frame, keep a copy for comparing
+            self.total = copy.deepcopy(total)
+            cache.pop('/api/total', None)
+
+    def respond(self, path):
+        cached = self.__cache.get(path)
+        if cached != None:
+            self.hits += 1
+            return cached
+        with self.__lock:
+            self.misses += 1
+            return self.__respond(path)
+
+    def __respond(self, path):
+        if path == '/api/converters':
+            body = {id: reading.dict() for id, reading in self.converters.items()}
+        elif path.startswith('/api/converters/') and path[16:] in self.converters:
+            body = self.converters[path[16:]].dict()
+        elif path == '/api/total' and self.total != None:
+            body = self.total
+        else:
+            return NOT_FOUND
+        cached = self.__cache[path] = response('200 OK', 'application/json', json.dumps(body).encode())
+        return cached
+
+
+class ApiServer(HttpServer):
+
+    # JSON API of the State of server:
+    #   /api/converters, /api/converters/<wrid>, /api/total
+
+    def __init__(self, server, host, port, l = None):
+        super().__init__(server, host, port, l)
+        self.state = server.state
+
+    def respond(self, path):
+        return self.state.respond(path)
@@ -0,0 +1,256 @@
+import array
+import mmap
+import os
+import shutil
+import time
+from slog import slog
+
+# numpy is optional and only imported by the first query, the proxy never needs it
+numpy = False
+
+
+def load_numpy():
+    global numpy
+    if numpy is False:
+        try:
+            import numpy as np
+            numpy = np
+        except ImportError:
+            numpy = None
+    return numpy
+
+# Columns of a segment: one append-only file per field, all of equal length
+FIELDS     = ('power', 'dc', 'ac', 'temp', 'freq', 'totalkwh')
+COLUMNS    = (('time', 'd'), ('wrid', 'I')) + tuple((f, 'd') for f in FIELDS)
+# rollup resolutions in seconds
+ROLLUPS    = (('1m', 60), ('15m', 900), ('1h', 3600))
+SEGMENT    = 86400
+
+
+class Rollup:
+    # Running aggregate of one converter in the current bucket of one resolution
+    __slots__ = ('start', 'count', 'sums', 'last')
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.sums  = [0.0] * len(FIELDS)
+        self.last  = 0.0
+
+
+class Store:
+
+    # Embedded time series store for converter readings
+    #
+    #   <path>/<resolution>/<segment>/<column>
+    #
+    # resolution is raw, 1m, 15m or 1h, a segment holds one UTC day and every
+    # column is an array of native doubles (wrid: unsigned int) appended in
+    # bulk. Rollups store the mean of every field per bucket, except totalkwh
+    # which is the last reading. Buckets still open on close are written
+    # with the readings so far, a bucket cut by a restart is stored as two
+    # rows with the same start. Segments older than the retention of their
+    # resolution are deleted. Rows that could not be written stay buffered for
+    # the next flush.
+
+    def __init__(self, path, l = None, flush_interval = 10, batch = 10000, retention = None, readonly = False):
+        if l == None:
+            self.__log = slog('Store class')
+        else:
+            self.__log = l
+        self.path           = path
+        self.flush_interval = flush_interval
+        self.batch          = batch
+        # days to keep per resolution, 0 keeps forever
+        self.retention      = {'raw': 7, '1m': 30, '15m': 365, '1h': 0}
+        if retention:
+            self.retention.update(retention)
+        self.readonly       = readonly
+        self.__buffers      = {res: self.__empty() for res in ['raw'] + [r for r, s in ROLLUPS]}
+        self.__rollups      = {res: {} for res, seconds in ROLLUPS}
+        self.__last_flush   = time.monotonic()
+        self.rows           = 0
+        if not readonly:
+            os.makedirs(path, exist_ok = True)
+
+    def __empty(self):
+        return {name: array.array(code) for name, code in COLUMNS}
+
+    def __append(self, res, t, wrid, values):
+        buf = self.__buffers[res]
+        buf['time'].append(t)
+        buf['wrid'].append(wrid)
+        for name, v in zip(FIELDS, values):
+            buf[name].append(v)
+
+    def add(self, wrdata, now = None):
+        # Buffer the readings of one frame, flushes when due
+        if now == None:
+            now = time.time()
+        for wrdict in wrdata:
+            wrid = int(wrdict['wrid'], 16)
+            values = [wrdict[f] for f in FIELDS]
+            self.__append('raw', now, wrid, values)
+            for res, seconds in ROLLUPS:
+                start = now - now % seconds
+                rollups = self.__rollups[res]
+                r = rollups.get(wrid)
+                if r == None or r.start != start:
+                    if r != None and r.count:
+                        self.__close_rollup(res, wrid, r)
+                    r = rollups[wrid] = Rollup(start)
+                r.count += 1
+                sums = r.sums
+                for i, v in enumerate(values):
+                    sums[i] += v
+                r.last = values[-1]
+        if len(self.__buffers['raw']['time']) >= self.batch or time.monotonic() - self.__last_flush >= self.flush_interval:
+            self.flush(now)
+
+    def __close_rollup(self, res, wrid, r):
+        values = [s / r.count for s in r.sums]
+        values[-1] = r.last
+        self.__append(res, r.start, wrid, values)
+
+    def flush(self, now = None, partial = False):
+        # Write buffered rows and finished rollup buckets, with partial also the
+        # open ones, apply retention
+        if now == None:
+            now = time.time()
+        for res, seconds in ROLLUPS:
+            rollups = self.__rollups[res]
+            for wrid, r in list(rollups.items()):
+                if partial or r.start + seconds <= now:
+                    self.__close_rollup(res, wrid, r)
+                    del rollups[wrid]
+        rows = 0
+        for res, buf in self.__buffers.items():
+            times = buf['time']
+            if not times:
+                continue
+            # rows are written to the segment of their day
+            pos = 0
+            while pos < len(times):
+                day = int(times[pos] // SEGMENT)
+                end = pos
+                while end < len(times) and int(times[end] // SEGMENT) == day:
+                    end += 1
+                folder = os.path.join(self.path, res, time.strftime('%Y%m%d', time.gmtime(day * SEGMENT)))
+                try:
+                    self.__write(folder, buf, pos, end)
+                except OSError as e:
+                    # keep the rows not written yet, the next flush tries again
+                    self.__log.logFmt('Store: writing %s failed: %s', folder, e, vlevel = 1)
+                    for name, code in COLUMNS:
+                        del buf[name][:pos]
+                    self.rows += rows + pos
+                    self.__last_flush = time.monotonic()
+                    return
+                pos = end
+            rows += len(times)
+            self.__buffers[res] = self.__empty()
+        self.rows += rows
+        self.__last_flush = time.monotonic()
+        self.__log.logMsg(lambda: 'Store: flushed ' + str(rows) + ' rows', 4)
+        self.expire(now)
+
+    def __write(self, folder, buf, pos, end):
+        # Append rows pos:end to all columns of a segment. On an error the
+        # columns are cut back to their previous size so they stay aligned.
+        os.makedirs(folder, exist_ok = True)
+        sizes = {}
+        try:
+            for name, code in COLUMNS:
+                p = os.path.join(folder, name)
+                sizes[p] = os.path.getsize(p) if os.path.exists(p) else 0
+                with open(p, 'ab') as f:
+                    buf[name][pos:end].tofile(f)
+        except OSError:
+            for p, size in sizes.items():
+                try:
+                    os.truncate(p, size)
+                except OSError:
+                    pass
+            raise
+
+    def expire(self, now = None):
+        if now == None:
+            now = time.time()
+        for res, days in self.retention.items():
+            folder = os.path.join(self.path, res)
+            if not days or not os.path.isdir(folder):
+                continue
+            oldest = time.strftime('%Y%m%d', time.gmtime(now - days * SEGMENT))
+            for segment in os.listdir(folder):
+                if segment < oldest:
+                    self.__log.logMsg('Store: removing ' + res + ' segment ' + segment, 3)
+                    shutil.rmtree(os.path.join(folder, segment), ignore_errors = True)
+
+    def close(self):
+        if not self.readonly:
+            self.flush(partial = True)
+
+    def __columns(self, folder, names):
+        # Maps the columns of a segment, cut to the length all columns have
+        maps = {}
+        for name, code in COLUMNS:
+            if name not in names:
+                continue
+            p = os.path.join(folder, name)
+            size = os.path.getsize(p) if os.path.exists(p) else 0
+            maps[name] = (p, code, size // array.array(code).itemsize)
+        rows = min(n for p, c, n in maps.values())
+        numpy = load_numpy()
+        result = {}
+        for name, (p, code, n) in maps.items():
+            if rows == 0:
+                data = b''
+            else:
+                with open(p, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+                data = memoryview(mm)[:rows * array.array(code).itemsize]
+            if numpy != None:
+                result[name] = numpy.frombuffer(data, dtype = code if code != 'd' else 'f8')
+            else:
+                a = array.array(code)
+                a.frombytes(data)
+                result[name] = a
+        return result
+
+    def query(self, wrid, start, end, field = 'power', resolution = 'raw'):
+        # (times, values) of one converter for start <= time < end, as numpy
+        # arrays if numpy is installed, otherwise as array.array
+        if isinstance(wrid, str):
+            wrid = int(wrid, 16)
+        numpy = load_numpy()
+        folder = os.path.join(self.path, resolution)
+        first = time.strftime('%Y%m%d', time.gmtime(start))
+        last  = time.strftime('%Y%m%d', time.gmtime(end))
+        segments = sorted(s for s in os.listdir(folder) if first <= s <= last) if os.path.isdir(folder) else []
+        times  = []
+        values = []
+        for segment in segments:
+            cols = self.__columns(os.path.join(folder, segment), ('time', 'wrid', field))
+            if numpy != None:
+                mask = (cols['wrid'] == wrid) & (cols['time'] >= start) & (cols['time'] < end)
+                times.append(cols['time'][mask])
+                values.append(cols[field][mask])
+            else:
+                t = array.array('d')
+                v = array.array('d')
+                for tt, w, vv in zip(cols['time'], cols['wrid'], cols[field]):
+                    if w == wrid and start <= tt < end:
+                        t.append(tt)
+                        v.append(vv)
+                times.append(t)
+                values.append(v)
+        if numpy != None:
+            if not times:
+                return numpy.empty(0), numpy.empty(0)
+            return numpy.concatenate(times), numpy.concatenate(values)
+        t = array.array('d')
+        v = array.array('d')
+        for a, b in zip(times, values):
+            t.extend(a)
+            v.extend(b)
+        return t, v
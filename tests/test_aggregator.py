@@ -0,0 +1,21 @@
+# Converter reports from the workers to the aggregator
+
+import socket
+
+from aggregator import REPORT, TotalClient
+from metrics import stats
+
+
+def test_reports_are_dropped_instead_of_blocking():
+    # nobody reads the aggregator end, the worker must go on anyway
+    aggregator, worker = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    worker.setblocking(False)
+    client = TotalClient(worker)
+    dropped = stats.reports_dropped
+    for i in range(1000):
+        assert client.data([{'wrid': '10000001', 'power': 1.5, 'totalkwh': 2.0}]) == None
+    assert stats.reports_dropped > dropped
+    aggregator.setblocking(False)
+    assert REPORT.unpack(aggregator.recv(65536)) == (b'10000001', 1.5, 2.0)
+    aggregator.close()
+    worker.close()
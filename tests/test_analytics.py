@@ -0,0 +1,78 @@
+# Energy, peaks and smoothed power of Analytics
+
+import math
+import time
+
+import pytest
+
+from analytics import Analytics
+from slog import slog
+
+
+def reading(kwh, power, wrid = '10000001'):
+    return [{'wrid': wrid, 'totalkwh': kwh, 'power': power}]
+
+
+def local(day, hour, minute = 0):
+    return time.mktime((2026, 6, day, hour, minute, 0, 0, 0, -1))
+
+
+@pytest.fixture
+def analytics():
+    return Analytics(slog('test', verbosity = 1, log_type = 'sys.stderr'), interval = 300, ewma = 300)
+
+
+def test_first_reading(analytics):
+    analytics.update(reading(100.0, 50.0), local(1, 12))
+    values = analytics.data()['10000001']
+    assert values['energy_today'] == 0.0
+    assert values['energy'] == 0.0
+    assert values['peak_power'] == 50.0
+    assert values['power_ewma'] == 50.0
+
+
+def test_energy_and_peak(analytics):
+    for minute, kwh, power in ((0, 100.0, 50.0), (1, 100.25, 200.0), (2, 100.5, 100.0)):
+        analytics.update(reading(kwh, power), local(1, 12, minute))
+    values = analytics.data()['10000001']
+    assert values['energy_today'] == 0.5
+    assert values['peak_power'] == 200.0
+    assert values['peak_time'] == '2026-06-01T12:01:00'
+
+
+def test_counter_reset(analytics):
+    analytics.update(reading(100.0, 50.0), local(1, 12, 0))
+    analytics.update(reading(100.5, 50.0), local(1, 12, 1))
+    # the converter starts again at 0, 0.25 kWh were produced since
+    analytics.update(reading(0.25, 50.0), local(1, 12, 2))
+    assert analytics.resets == 1
+    assert analytics.data()['10000001']['energy'] == 0.75
+
+
+def test_midnight(analytics):
+    analytics.update(reading(100.0, 300.0), local(1, 18))
+    analytics.update(reading(101.0, 10.0), local(1, 23, 50))
+    assert analytics.data()['10000001']['energy_today'] == 1.0
+    # the increase up to the first reading after midnight counts for the new day
+    analytics.update(reading(101.25, 20.0), local(2, 6))
+    values = analytics.data()['10000001']
+    assert values['energy_today'] == 0.25
+    assert values['energy'] == 1.25
+    assert values['peak_power'] == 20.0
+    assert values['peak_time'] == '2026-06-02T06:00:00'
+
+
+def test_ewma(analytics):
+    analytics.update(reading(1.0, 0.0), 1000.0)
+    # after one time constant the smoothed power has moved 1 - 1/e of the way
+    analytics.update(reading(1.0, 100.0), 1300.0)
+    assert analytics.data()['10000001']['power_ewma'] == pytest.approx(100.0 * (1 - math.exp(-1)))
+    # readings at the same time do not move it
+    analytics.update(reading(1.0, 1000.0), 1300.0)
+    assert analytics.data()['10000001']['power_ewma'] == pytest.approx(100.0 * (1 - math.exp(-1)))
+
+
+def test_due_once_per_interval(analytics):
+    assert analytics.due(1000.0)
+    assert not analytics.due(1299.0)
+    assert analytics.due(1300.0)
@@ -0,0 +1,38 @@
+# decoder.decode against the hex string decoder used up to version 1.4
+
+import random
+
+import pytest
+
+import benchlib
+import decoder
+from bench_decoder import process_data
+
+
+def random_frame(rnd, converters, length = 982):
+    frame = bytearray(rnd.randbytes(length))
+    frame[0:6] = bytes.fromhex('6803d6681004')
+    for i in range((length - 20) // 32):
+        if i >= converters:
+            frame[20+i*32:24+i*32] = bytes(4)
+    return bytes(frame)
+
+
+@pytest.mark.parametrize('frame', [benchlib.PAYLOAD, benchlib.payload(range(1, 31))] + benchlib.trace_frames()[2:3],
+                         ids = ['one converter', 'thirty converters', 'trace'])
+def test_known_frames(frame):
+    assert decoder.decode(frame) == process_data(frame)
+
+
+def test_random_frames():
+    rnd = random.Random(1)
+    for i in range(2000):
+        frame = random_frame(rnd, rnd.randint(0, 30))
+        assert decoder.decode(frame) == process_data(frame), frame.hex()
+
+
+def test_short_frames():
+    rnd = random.Random(2)
+    for i in range(100):
+        frame = random_frame(rnd, 2, 86)
+        assert decoder.decode(frame) == process_data(frame), frame.hex()
@@ -0,0 +1,47 @@
+# Framer reassembly of the trace frames, however the TCP stream is cut
+
+import random
+
+import pytest
+
+import benchlib
+from framer import Framer
+
+FRAMES = benchlib.trace_frames() + [benchlib.HANDSHAKE, benchlib.PAYLOAD]
+STREAM = b''.join(FRAMES)
+
+
+def reassemble(stream, sizes):
+    framer = Framer()
+    frames = []
+    pos = 0
+    while pos < len(stream):
+        n = next(sizes)
+        frames.extend(framer.feed(stream[pos:pos+n]))
+        pos += n
+    assert len(framer) == 0, str(len(framer)) + ' bytes left in framer'
+    return frames
+
+
+def test_byte_by_byte():
+    assert reassemble(STREAM, iter(lambda: 1, 0)) == FRAMES
+
+
+def test_coalesced():
+    assert reassemble(STREAM, iter(lambda: len(STREAM), 0)) == FRAMES
+
+
+@pytest.mark.parametrize('top', [8, 64, 1500, 4096])
+def test_random_chunks(top):
+    rnd = random.Random(top)
+    for i in range(50):
+        assert reassemble(STREAM, iter(lambda: rnd.randint(1, top), 0)) == FRAMES
+
+
+def test_garbage_between_frames():
+    # garbage is returned separately and does not break the frames around it
+    rnd = random.Random(1)
+    frames = reassemble(FRAMES[0] + b'\x00\x01garbage' + FRAMES[-1], iter(lambda: rnd.randint(1, 16), 0))
+    assert frames[0] == FRAMES[0]
+    assert frames[-1] == FRAMES[-1]
+    assert b''.join(frames[1:-1]) == b'\x00\x01garbage'
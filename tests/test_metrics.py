@@ -0,0 +1,25 @@
+# Histograms observed by several threads
+
+import threading
+
+from metrics import LATENCY, ThreadHistogram
+
+
+def test_thread_histogram_loses_no_observations():
+    h = ThreadHistogram(LATENCY)
+
+    def observe():
+        for i in range(20000):
+            h.observe(0.0003)
+
+    threads = [threading.Thread(target = observe) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    h.observe(2.0)
+    text = []
+    h.render('enverproxy_test_seconds', text)
+    assert 'enverproxy_test_seconds_bucket{le="0.0005"} 80000' in text
+    assert 'enverproxy_test_seconds_bucket{le="1.0"} 80000' in text
+    assert 'enverproxy_test_seconds_count 80001' in text
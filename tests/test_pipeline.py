@@ -0,0 +1,74 @@
+# Order, coalescing and load shedding of the Pipeline
+
+import time
+
+from pipeline import Pipeline
+
+
+class Server:
+    # Stands in for TheServer: decoding returns the frame, submitting records it
+    def __init__(self, delay = 0.0):
+        self.delay = delay
+        self.submitted = []
+
+    def decode_data(self, data):
+        return data
+
+    def submit_data(self, wrdata):
+        if self.delay:
+            # like a paho publish that blocks for a moment
+            time.sleep(self.delay)
+        self.submitted.append(wrdata)
+
+
+def frame(wrid, n = 0):
+    # bytes 20-24 hold the first converter id, the rest tells frames apart
+    return bytes(20) + wrid.to_bytes(4, 'big') + n.to_bytes(4, 'big')
+
+
+def test_threads_keep_put_order():
+    server = Server(0.0002)
+    pipeline = Pipeline(server, 4, 10000)
+    pipeline.start()
+    frames = [frame(1, n) for n in range(3000)]
+    for f in frames:
+        pipeline.put('10.0.0.1', f)
+    pipeline.stop(30)
+    assert server.submitted == frames
+
+
+def test_coalesce_keeps_newest_frame_per_key():
+    server = Server()
+    pipeline = Pipeline(server, 1, 3, 'coalesce')
+    for n in range(6):
+        pipeline.put('10.0.0.1', frame(1 + n % 2, n))
+    # another bridge with the same converter id is a different key
+    pipeline.put('10.0.0.2', frame(1, 6))
+    pipeline.start()
+    pipeline.stop()
+    assert server.submitted == [frame(1, 4), frame(2, 5), frame(1, 6)]
+    assert pipeline.dropped == 4
+
+
+def test_drop_oldest():
+    server = Server()
+    pipeline = Pipeline(server, 1, 3, 'drop-oldest')
+    for n in range(5):
+        pipeline.put('10.0.0.1', frame(1, n))
+    assert len(pipeline) == 3
+    assert pipeline.dropped == 2
+    pipeline.start()
+    pipeline.stop()
+    assert server.submitted == [frame(1, 2), frame(1, 3), frame(1, 4)]
+
+
+def test_stop_drains_the_queue():
+    server = Server(0.001)
+    pipeline = Pipeline(server, 2, 1000)
+    pipeline.start()
+    frames = [frame(n) for n in range(200)]
+    for f in frames:
+        pipeline.put('10.0.0.1', f)
+    pipeline.stop()
+    assert len(pipeline) == 0
+    assert server.submitted == frames
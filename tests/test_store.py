@@ -0,0 +1,90 @@
+# Rollups, retention, queries and failed writes of the time series store
+
+import array
+import os
+
+import pytest
+
+import store
+from slog import slog
+from store import Store
+
+DAY = 86400
+# 2026-06-01 00:00:00 UTC
+T0  = 1780272000.0
+
+
+def reading(power, totalkwh, wrid = '1000000a'):
+    return [{'wrid': wrid, 'power': power, 'dc': 30.0, 'ac': 230.0, 'temp': 40.0, 'freq': 50.0, 'totalkwh': totalkwh}]
+
+
+@pytest.fixture
+def db(tmp_path):
+    return Store(str(tmp_path), slog('test', verbosity = 1, log_type = 'sys.stderr'), flush_interval = 3600, batch = 100000)
+
+
+def test_rollup_mean_and_last(db):
+    for i, power in enumerate((100.0, 200.0, 300.0)):
+        db.add(reading(power, 10.0 + i), T0 + i * 10)
+    db.add(reading(50.0, 20.0), T0 + 60)
+    # writes the open buckets too
+    db.flush(T0 + 70, partial = True)
+    times, power = db.query('1000000a', T0, T0 + 120, 'power', '1m')
+    assert list(times) == [T0, T0 + 60]
+    assert list(power) == [200.0, 50.0]
+    times, kwh = db.query('1000000a', T0, T0 + 120, 'totalkwh', '1m')
+    assert list(kwh) == [12.0, 20.0]
+    times, power = db.query('1000000a', T0, T0 + 120, 'power', '1h')
+    assert list(times) == [T0]
+    assert list(power) == [162.5]
+
+
+def test_query_range_converter_and_days(db, monkeypatch):
+    monkeypatch.setattr(store, 'numpy', None)
+    db.add(reading(1.0, 1.0), T0 - 10)
+    db.add(reading(2.0, 1.0) + reading(9.0, 1.0, wrid = '1000000b'), T0 + 10)
+    db.add(reading(3.0, 1.0), T0 + 20)
+    db.flush(T0 + 30)
+    assert sorted(os.listdir(os.path.join(db.path, 'raw'))) == ['20260531', '20260601']
+    times, power = db.query('1000000a', T0 - 60, T0 + 20)
+    assert isinstance(power, array.array)
+    assert list(times) == [T0 - 10, T0 + 10]
+    assert list(power) == [1.0, 2.0]
+    times, power = db.query(0x1000000b, T0, T0 + 60)
+    assert list(power) == [9.0]
+    times, power = Store(db.path, readonly = True).query('1000000a', T0 + 100, T0 + 200)
+    assert len(times) == 0
+
+
+def test_retention(db):
+    db.retention['1h'] = 0
+    for day in (0, 6, 8, 40):
+        db.add(reading(1.0, 1.0), T0 - day * DAY)
+    db.flush(T0 + 3600)
+    assert sorted(os.listdir(os.path.join(db.path, 'raw'))) == ['20260526', '20260601']
+    assert sorted(os.listdir(os.path.join(db.path, '1m'))) == ['20260524', '20260526', '20260601']
+    assert len(os.listdir(os.path.join(db.path, '15m'))) == 4
+    assert len(os.listdir(os.path.join(db.path, '1h'))) == 4
+    db.expire(T0 + 30 * DAY)
+    assert not os.listdir(os.path.join(db.path, 'raw'))
+    assert sorted(os.listdir(os.path.join(db.path, '1m'))) == ['20260601']
+
+
+def test_failed_flush_keeps_rows_and_columns_aligned(db):
+    db.add(reading(1.0, 1.0), T0)
+    db.flush(T0 + 1)
+    # writing the power column fails after time and wrid were appended
+    db.add(reading(2.0, 1.0), T0 + 2)
+    blocker = os.path.join(db.path, 'raw', '20260601', 'power')
+    os.rename(blocker, blocker + '.saved')
+    os.mkdir(blocker)
+    db.flush(T0 + 3)
+    sizes = {name: os.path.getsize(os.path.join(db.path, 'raw', '20260601', name)) for name in ('time', 'wrid', 'dc')}
+    assert sizes == {'time': 8, 'wrid': 4, 'dc': 8}
+    os.rmdir(blocker)
+    os.rename(blocker + '.saved', blocker)
+    db.add(reading(3.0, 1.0), T0 + 4)
+    db.flush(T0 + 5)
+    times, power = db.query('1000000a', T0, T0 + 10)
+    assert list(times) == [T0, T0 + 2, T0 + 4]
+    assert list(power) == [1.0, 2.0, 3.0]
@@ -0,0 +1,75 @@
+# Total with running sums and expiry heap against the full scan used up to version 1.4
+
+import configparser
+import json
+import random
+
+import pytest
+
+import enverproxy
+from slog import slog
+
+PHASE_MAP = {'L1': [10000001, 10000002, 10000003], 'L2': [10000004, 10000005], 'L3': [10000006]}
+
+
+class ScanTotal:
+    # Total.data of version 1.4: every converter is kept and all of them are summed per call
+
+    def __init__(self, ttl, phase_map):
+        self.ttl = ttl
+        self.phase_map = phase_map
+        self.devices = {}
+
+    def data(self, wrdata, now):
+        for wrdict in wrdata:
+            id = int(wrdict['wrid'])
+            d = self.devices.get(id)
+            phase = None
+            if d:
+                phase = d['phase']
+            elif self.phase_map:
+                phase = next((p for p in ('L1', 'L2', 'L3') if id in self.phase_map.get(p, [])), None)
+            self.devices[id] = {'power': wrdict['power'], 'ttl': now + self.ttl, 'phase': phase}
+        power = 0.0
+        count = 0
+        phases = {'L1': {'power': 0.0}, 'L2': {'power': 0.0}, 'L3': {'power': 0.0}} if self.phase_map else None
+        for value in self.devices.values():
+            if value['ttl'] > now:
+                count += 1
+                power += value['power']
+                if phases and value['phase']:
+                    phases[value['phase']]['power'] += value['power']
+        msg = {'count': count, 'grid': {'power': power}}
+        if phases:
+            msg['grid'].update(phases)
+        return msg
+
+
+def config(ttl, phase_map):
+    c = configparser.ConfigParser()
+    c['enverproxy'] = {'total_calculate': 'True', 'total_TTL': str(ttl)}
+    if phase_map:
+        c['enverproxy']['total_phase_map'] = json.dumps(phase_map)
+    return c
+
+
+@pytest.mark.parametrize('phase_map', [None, PHASE_MAP], ids = ['no phase map', 'phase map'])
+def test_matches_scan(monkeypatch, phase_map):
+    rnd = random.Random(1)
+    now = [1700000000]
+    monkeypatch.setattr(enverproxy.time, 'time', lambda: now[0])
+    total = enverproxy.Total(slog('test', verbosity = 0, log_type = 'sys.stderr'), config(30, phase_map))
+    scan = ScanTotal(30, phase_map)
+    for i in range(5000):
+        # frames of up to 4 of 8 converters, some of them silent long enough to expire
+        now[0] += rnd.choice([0, 0, 1, 2, 5, 40])
+        wrdata = [{'wrid': str(id), 'power': rnd.randint(0, 64 * 400) / 64}
+                  for id in rnd.sample(range(10000001, 10000009), rnd.randint(0, 4))]
+        assert total.data(wrdata) == scan.data(wrdata, now[0])
+
+
+def test_disabled():
+    c = config(30, None)
+    c['enverproxy']['total_calculate'] = 'False'
+    total = enverproxy.Total(slog('test', verbosity = 0, log_type = 'sys.stderr'), c)
+    assert total.data([{'wrid': '10000001', 'power': 1.0}]) == None
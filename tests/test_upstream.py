@@ -0,0 +1,79 @@
+# Retries of upstream connects and the store and forward queue
+
+import socket
+import time
+import urllib.request
+
+import pytest
+
+import benchlib
+from upstream import Backoff, ForwardQueue
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def test_backoff_doubles_up_to_maximum():
+    b = Backoff(1.0, 4.0)
+    delays = []
+    for i in range(4):
+        b.failure(100.0)
+        delays.append(b.delay)
+    assert delays == [1.0, 2.0, 4.0, 4.0]
+    assert not b.ready(103.0)
+    assert b.ready(104.0)
+    b.success()
+    assert b.ready(0.0) and b.ready(0.0, background = True)
+
+
+def test_backoff_floor_without_backoff():
+    # bridges may retry at once, background attempts wait for the floor
+    b = Backoff(0.0, 60.0, floor = 1.0)
+    b.failure(100.0)
+    assert b.ready(100.0)
+    assert not b.ready(100.5, background = True)
+    assert b.ready(101.0, background = True)
+
+
+def test_forward_queue_drops_oldest_of_largest():
+    q = ForwardQueue(10)
+    q.put('a', b'1234')
+    q.put('b', b'12')
+    q.put('a', b'5678')
+    q.put('b', b'34')
+    assert q.dropped == 1
+    assert q.take('a') == b'5678'
+    assert q.take('b') == b'1234'
+    assert len(q) == 0 and q.bytes == 0
+
+
+def connect_failures(port):
+    with urllib.request.urlopen('http://127.0.0.1:' + str(port) + '/metrics') as r:
+        for line in r.read().decode().split('\n'):
+            if line.startswith('enverproxy_upstream_connect_failures_total'):
+                return float(line.split()[-1])
+
+
+@pytest.mark.parametrize('mode', ['pool', 'queue'])
+def test_refused_portal_is_not_retried_in_a_busy_loop(mode):
+    # forward_backoff 0 is the default, the pool and the queue still have to wait between attempts
+    metrics_port = free_port()
+    kwargs = {'forward_pool': 2} if mode == 'pool' else {'forward_queue': ForwardQueue()}
+    proc, port, counter = benchlib.start_server(forward_to = ('127.0.0.1', free_port()), metrics_port = metrics_port, **kwargs)
+    try:
+        if mode == 'queue':
+            bridge = socket.create_connection(('127.0.0.1', port))
+            bridge.send(benchlib.HANDSHAKE)
+            bridge.recv(4096)
+            bridge.send(benchlib.PAYLOAD)
+        time.sleep(2)
+        failures = connect_failures(metrics_port)
+    finally:
+        proc.terminate()
+        proc.join()
+    assert 1 <= failures <= 10
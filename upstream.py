@@ -0,0 +1,105 @@
+import time
+from collections import deque
+
+
+class Backoff:
+
+    # Delay between upstream connection attempts, doubled after every failure
+    # up to maximum and reset by a successful connect. initial 0 disables it
+    # for the connects of bridges. Background attempts nobody waits for (pool
+    # refills, store and forward) always wait at least floor seconds after a
+    # failure, otherwise an unreachable portal is retried in a busy loop.
+
+    def __init__(self, initial = 1.0, maximum = 60.0, floor = 1.0):
+        self.initial  = initial
+        self.maximum  = maximum
+        self.floor    = floor
+        self.delay    = 0.0
+        # monotonic time of the next allowed attempt, for background attempts
+        self.retry    = 0.0
+        self.background = 0.0
+        self.failures = 0
+
+    def ready(self, now = None, background = False):
+        retry = self.background if background else self.retry
+        if retry == 0.0:
+            return True
+        if now == None:
+            now = time.monotonic()
+        return now >= retry
+
+    def failure(self, now = None):
+        self.failures += 1
+        if now == None:
+            now = time.monotonic()
+        if self.initial:
+            self.delay = min(max(self.delay * 2, self.initial), self.maximum)
+            self.retry = now + self.delay
+        self.background = max(self.retry, now + self.floor)
+
+    def success(self):
+        self.delay = 0.0
+        self.retry = 0.0
+        self.background = 0.0
+
+
+class ForwardQueue:
+
+    # Frames of bridges waiting for delivery to the portal (store and forward),
+    # per bridge IP in the order received. Above size bytes the oldest frames
+    # of the bridge with the most queued bytes are dropped.
+
+    def __init__(self, size = 1048576):
+        self.size      = size
+        self.bytes     = 0
+        self.dropped   = 0
+        self.delivered = 0
+        self.__frames  = {}
+        self.__bytes   = {}
+
+    def __len__(self):
+        return len(self.__frames)
+
+    def __contains__(self, ip):
+        return ip in self.__frames
+
+    def put(self, ip, frame):
+        frames = self.__frames.get(ip)
+        if frames == None:
+            frames = self.__frames[ip] = deque()
+            self.__bytes[ip] = 0
+        frames.append(frame)
+        self.__bytes[ip] += len(frame)
+        self.bytes += len(frame)
+        while self.bytes > self.size:
+            largest = max(self.__bytes, key = self.__bytes.get)
+            self.__drop(largest, self.__frames[largest].popleft())
+            self.dropped += 1
+
+    def __drop(self, ip, frame):
+        self.__bytes[ip] -= len(frame)
+        self.bytes -= len(frame)
+        if not self.__frames[ip]:
+            del self.__frames[ip]
+            del self.__bytes[ip]
+
+    def requeue(self, ip, data):
+        # Data that was not delivered goes back in front of the queue
+        frames = self.__frames.get(ip)
+        if frames == None:
+            frames = self.__frames[ip] = deque()
+            self.__bytes[ip] = 0
+        frames.appendleft(bytes(data))
+        self.__bytes[ip] += len(data)
+        self.bytes += len(data)
+        self.delivered -= len(data)
+
+    def take(self, ip):
+        # All queued data of ip as one buffer
+        frames = self.__frames.pop(ip, None)
+        if frames == None:
+            return b''
+        n = self.__bytes.pop(ip)
+        self.bytes -= n
+        self.delivered += n
+        return b''.join(frames)